@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Load test and benchmark for Screenshot to Todoist
+This script starts local stand-ins for the Anthropic and Todoist APIs, runs the
+application against them and drives /process-screenshot at a fixed concurrency,
+so changes to the pipeline can be measured offline without API keys or costs
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs
+
+import requests
+
+# Typical screenshot resolutions (width, height)
+SCREEN_SIZES = {
+    "iphone-se": (750, 1334),
+    "iphone-14": (1170, 2532),
+    "iphone-15-pro-max": (1290, 2796),
+    "ipad-pro": (2048, 2732)
+}
+
+class StubConfig:
+    """Latency and error settings shared by the stub API handlers"""
+    anthropic_latency = 1.5
+    todoist_latency = 0.15
+    jitter = 0.2
+    error_rate = 0.0
+    rest_attachment_status = 404
+    token_latency = 0.02
+    calls = {}
+    calls_lock = threading.Lock()
+    anthropic_reply = "02: Benchmark task from screenshot\n\nThe screenshot shows a message that needs a reply."
+    anthropic_tool_input = {"title": "Benchmark task from screenshot", "estimated_minutes": 20}
+
+class StubAPIHandler(BaseHTTPRequestHandler):
+    """Imitates the Anthropic Messages API and the Todoist endpoints used by the application"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/rest/v2/projects"):
+            self._delay(StubConfig.todoist_latency)
+            return self._send(200, [{"id": "1", "name": "Inbox"}])
+        self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = self.path.split("?")[0]
+        with StubConfig.calls_lock:
+            StubConfig.calls[path] = StubConfig.calls.get(path, 0) + 1
+
+        if path == "/v1/messages":
+            self._delay(StubConfig.anthropic_latency)
+            if random.random() < StubConfig.error_rate:
+                return self._send(529, {"type": "error", "error": {"type": "overloaded_error", "message": "Overloaded"}})
+            request_data = json.loads(body)
+            reply, stop_reason = StubConfig.anthropic_reply, "end_turn"
+            for stop in request_data.get("stop_sequences") or []:
+                if stop in reply:
+                    reply, stop_reason = reply[:reply.index(stop)], "stop_sequence"
+            content = [{"type": "text", "text": reply}]
+            if request_data.get("tools"):
+                # A forced tool call replies with the tool input only
+                content = [{"type": "tool_use", "id": f"toolu_{random.getrandbits(64):016x}",
+                            "name": request_data["tools"][0]["name"], "input": StubConfig.anthropic_tool_input}]
+                stop_reason = "tool_use"
+            message = {
+                "id": f"msg_{random.getrandbits(64):016x}",
+                "type": "message",
+                "role": "assistant",
+                "model": request_data.get("model", "stub"),
+                "content": content,
+                "stop_reason": stop_reason,
+                "stop_sequence": None,
+                "usage": {"input_tokens": 1200, "output_tokens": 12}
+            }
+            if request_data.get("stream"):
+                return self._send_message_stream(message)
+            return self._send(200, message)
+
+        self._delay(StubConfig.todoist_latency)
+        if random.random() < StubConfig.error_rate:
+            return self._send(503, {"error": "Service unavailable"})
+        if path == "/rest/v2/tasks":
+            return self._send(200, {"id": str(random.getrandbits(32)), "content": json.loads(body).get("content")})
+        if path == "/rest/v2/attachments":
+            return self._send(StubConfig.rest_attachment_status, {"error": "stub"} if StubConfig.rest_attachment_status >= 400 else {"id": "1"})
+        if path == "/sync/v9/sync":
+            commands = json.loads(parse_qs(body.decode()).get("commands", ["[]"])[0])
+            return self._send(200, {
+                "sync_status": {command["uuid"]: "ok" for command in commands},
+                "temp_id_mapping": {command["temp_id"]: str(random.getrandbits(32))
+                                    for command in commands if command.get("temp_id")}
+            })
+        if path == "/sync/v9/uploads/add":
+            return self._send(200, {"file_url": "https://example.com/screenshot.jpg", "file_name": "screenshot.jpg",
+                                    "file_type": "image/jpeg", "file_size": len(body), "upload_state": "completed"})
+        if path == "/rest/v2/comments":
+            return self._send(200, {"id": str(random.getrandbits(32)), "content": "Screenshot attachment"})
+        self._send(404, {"error": "not found"})
+
+    def _send_message_stream(self, message):
+        # Server-sent events as sent by the Messages API, one word per delta
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        words = message["content"][0]["text"].split(" ")
+        start = dict(message, content=[], stop_reason=None, usage={"input_tokens": 1200, "output_tokens": 1})
+        events = [("message_start", {"type": "message_start", "message": start}),
+                  ("content_block_start", {"type": "content_block_start", "index": 0,
+                                           "content_block": {"type": "text", "text": ""}})]
+        events += [("content_block_delta", {"type": "content_block_delta", "index": 0,
+                                            "delta": {"type": "text_delta", "text": word if i == 0 else " " + word}})
+                   for i, word in enumerate(words)]
+        events += [("content_block_stop", {"type": "content_block_stop", "index": 0}),
+                   ("message_delta", {"type": "message_delta", "delta": {"stop_reason": message["stop_reason"],
+                                                                          "stop_sequence": None},
+                                      "usage": {"output_tokens": message["usage"]["output_tokens"]}}),
+                   ("message_stop", {"type": "message_stop"})]
+        try:
+            for event, data in events:
+                self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode())
+                self.wfile.flush()
+                if event == "content_block_delta":
+                    time.sleep(StubConfig.token_latency)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading early
+            pass
+
+    def _delay(self, latency):
+        time.sleep(max(0.0, random.gauss(latency, latency * StubConfig.jitter)))
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def start_stub_server():
+    """Start the stub API server on a free local port and return its base URL"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAPIHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def build_corpus(sizes, count, corpus_dir=None):
+    """
+    Build the images to upload
+    Uses the images in corpus_dir if given, otherwise generates screenshot-like PNGs
+    with text and photo regions, so the file sizes resemble real screenshots
+    """
+    if corpus_dir:
+        corpus = []
+        for name in sorted(os.listdir(corpus_dir)):
+            if name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")):
+                with open(os.path.join(corpus_dir, name), "rb") as f:
+                    mime_type = "image/png" if name.lower().endswith(".png") else "image/jpeg"
+                    corpus.append((name, f.read(), mime_type))
+        return corpus
+
+    from PIL import Image, ImageDraw
+    corpus = []
+    for index in range(count):
+        size_name = sizes[index % len(sizes)]
+        width, height = SCREEN_SIZES[size_name]
+        img = Image.new("RGB", (width, height), (255, 255, 255))
+        draw = ImageDraw.Draw(img)
+        draw.rectangle((0, 0, width, height // 20), fill=(247, 247, 247))
+        for y in range(height // 10, height, 48):
+            draw.text((40, y), f"Message {index}-{y}: please send the quarterly report before Friday", fill=(20, 20, 20))
+        # A noisy "photo" region makes the PNG compress like a real screenshot
+        photo = Image.effect_noise((width - 80, height // 4), 40).convert("RGB")
+        img.paste(photo, (40, height // 2))
+        output = io.BytesIO()
+        img.save(output, "PNG")
+        corpus.append((f"{size_name}-{index}.png", output.getvalue(), "image/png"))
+    return corpus
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_app(stub_url, port, extra_env, serve_mode="wsgi"):
+    """Run the application in a separate process so its memory can be measured on its own"""
+    env = dict(os.environ)
+    env.update({
+        "ANTHROPIC_API_KEY": "benchmark-anthropic-key",
+        "TODOIST_API_KEY": "benchmark-todoist-key-0123456789abcdef",
+        "ANTHROPIC_BASE_URL": stub_url,
+        "TODOIST_API_BASE": stub_url,
+        "RESULT_CACHE_SIZE": "0",
+        # The corpus repeats images, so derived keys would replay stored responses instead of measuring
+        "IDEMPOTENCY_DERIVE_KEYS": "false",
+        # Measure direct task creation; the outbox would hide Todoist errors and write a database
+        "OUTBOX_MODE": "off",
+        # The stubs have no rate limits, so only the adaptive concurrency limits apply
+        "ANTHROPIC_RATE_LIMIT": "10000",
+        "ANTHROPIC_BURST": "10000",
+        "TODOIST_RATE_LIMIT": "10000",
+        "TODOIST_BURST": "10000"
+    })
+    env.update(extra_env)
+    if serve_mode == "asgi":
+        code = (
+            "import sys; sys.path.insert(0, {root!r})\n"
+            "import uvicorn\n"
+            "import screenshot_to_todoist_asgi as m\n"
+            "uvicorn.run(m.create_app(), host='127.0.0.1', port={port}, log_level='warning')\n"
+        )
+    else:
+        code = (
+            "import sys; sys.path.insert(0, {root!r})\n"
+            "from werkzeug.serving import run_simple\n"
+            "import screenshot_to_todoist as m\n"
+            "run_simple('127.0.0.1', {port}, m.create_app(), threaded=True)\n"
+        )
+    code = code.format(root=os.path.dirname(os.path.abspath(__file__)), port=port)
+    process = subprocess.Popen([sys.executable, "-c", code], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Wait for the application to answer
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Application exited with code {process.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health/live", timeout=1).status_code == 200:
+                return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Application did not start within 30 seconds")
+
+def process_memory_kb(pid):
+    """Return the current and peak resident memory of a process in KB"""
+    memory = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    memory[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return memory.get("VmRSS"), memory.get("VmHWM")
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+def run_load(url, corpus, concurrency, total_requests, extra_params):
+    """Send total_requests uploads with a fixed number of concurrent clients"""
+    local = threading.local()
+    counter = iter(range(total_requests))
+    counter_lock = threading.Lock()
+    results = []
+    results_lock = threading.Lock()
+
+    def client_loop():
+        local.session = requests.Session()
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                return
+            name, data, mime_type = corpus[index % len(corpus)]
+            start_time = time.perf_counter()
+            try:
+                response = local.session.post(url, params=extra_params, files={"image": (name, data, mime_type)}, timeout=120)
+                status = response.status_code
+            except requests.RequestException:
+                status = None
+            latency = time.perf_counter() - start_time
+            with results_lock:
+                results.append((status, latency, len(data)))
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client_loop)
+    return results, time.perf_counter() - start_time
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmark /process-screenshot against local stub APIs")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of concurrent clients")
+    parser.add_argument("--requests", type=int, default=64, help="Total number of requests")
+    parser.add_argument("--sizes", default=",".join(SCREEN_SIZES), help="Comma-separated screenshot sizes to generate")
+    parser.add_argument("--corpus-size", type=int, default=16, help="Number of images to generate")
+    parser.add_argument("--corpus-dir", help="Directory with real screenshots to use instead of generated ones")
+    parser.add_argument("--anthropic-latency", type=float, default=1.5, help="Mean latency of the stub Anthropic API in seconds")
+    parser.add_argument("--todoist-latency", type=float, default=0.15, help="Mean latency of the stub Todoist API in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of stub API calls that fail")
+    parser.add_argument("--rest-attachment-status", type=int, default=404, help="Status returned by the REST attachments stub")
+    parser.add_argument("--async-mode", action="store_true", help="Use async=true (measures time to 202 only)")
+    parser.add_argument("--serve-mode", choices=("wsgi", "asgi"), default="wsgi", help="Serve the Flask app or the async app")
+    parser.add_argument("--app-url", help="Benchmark an already running application instead of starting one")
+    parser.add_argument("--env", action="append", default=[], help="Extra KEY=VALUE environment for the application")
+    parser.add_argument("--json", help="Write the results as JSON to this file")
+
+    args = parser.parse_args()
+
+    StubConfig.anthropic_latency = args.anthropic_latency
+    StubConfig.todoist_latency = args.todoist_latency
+    StubConfig.error_rate = args.error_rate
+    StubConfig.rest_attachment_status = args.rest_attachment_status
+
+    print("Building corpus...")
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    corpus = build_corpus(sizes, args.corpus_size, args.corpus_dir)
+    if not corpus:
+        print("Error: The corpus is empty")
+        sys.exit(1)
+    print(f"Corpus: {len(corpus)} images, {sum(len(item[1]) for item in corpus) / len(corpus) / 1024:.0f} KB on average")
+
+    stub_server, stub_url = start_stub_server()
+    print(f"Stub APIs listening on {stub_url}")
+
+    process = None
+    if args.app_url:
+        app_url = args.app_url.rstrip("/")
+    else:
+        port = free_port()
+        extra_env = dict(item.split("=", 1) for item in args.env)
+        launched_at = time.perf_counter()
+        process = start_app(stub_url, port, extra_env, args.serve_mode)
+        ready_seconds = time.perf_counter() - launched_at
+        app_url = f"http://127.0.0.1:{port}"
+        print(f"Application running at {app_url} (PID {process.pid}, answered after {ready_seconds:.2f} s)")
+
+    try:
+        params = {"async": "true"} if args.async_mode else {}
+        print(f"Sending {args.requests} requests with concurrency {args.concurrency}...")
+        results, elapsed = run_load(f"{app_url}/process-screenshot", corpus, args.concurrency, args.requests, params)
+
+        latencies = [latency for status, latency, _ in results if status is not None and status < 400]
+        errors = sum(1 for status, _, _ in results if status is None or status >= 400)
+        rss_kb, peak_kb = process_memory_kb(process.pid) if process else (None, None)
+        try:
+            startup = requests.get(f"{app_url}/stats", timeout=5).json().get("startup")
+        except (requests.RequestException, ValueError):
+            startup = None
+
+        report = {
+            "requests": len(results),
+            "errors": errors,
+            "concurrency": args.concurrency,
+            "elapsed_seconds": round(elapsed, 2),
+            "requests_per_second": round(len(results) / elapsed, 2) if elapsed else 0.0,
+            "latency_seconds": {
+                "p50": round(percentile(latencies, 0.50), 3),
+                "p95": round(percentile(latencies, 0.95), 3),
+                "p99": round(percentile(latencies, 0.99), 3),
+                "max": round(max(latencies), 3) if latencies else 0.0
+            },
+            "server_memory_kb": {"rss": rss_kb, "peak": peak_kb},
+            "server_startup": startup,
+            "stub_calls": dict(StubConfig.calls),
+            "stub": {
+                "anthropic_latency": args.anthropic_latency,
+                "todoist_latency": args.todoist_latency,
+                "error_rate": args.error_rate
+            }
+        }
+
+        print("\nResults:")
+        print(f"  Requests:        {report['requests']} ({errors} errors)")
+        print(f"  Throughput:      {report['requests_per_second']} requests/s")
+        print(f"  Latency p50:     {report['latency_seconds']['p50']} s")
+        print(f"  Latency p95:     {report['latency_seconds']['p95']} s")
+        print(f"  Latency p99:     {report['latency_seconds']['p99']} s")
+        todoist_calls = sum(count for path, count in StubConfig.calls.items() if path != "/v1/messages")
+        print(f"  Todoist calls:   {todoist_calls} ({todoist_calls / len(results):.2f} per request)")
+        if rss_kb is not None:
+            print(f"  Server memory:   {rss_kb / 1024:.1f} MB RSS, {peak_kb / 1024:.1f} MB peak")
+        if startup and startup.get("import_seconds") is not None:
+            print(f"  Server startup:  import {startup['import_seconds'] * 1000:.0f} ms, "
+                  f"create_app {(startup.get('create_app_seconds') or 0) * 1000:.0f} ms, "
+                  f"first request after {startup.get('first_request_seconds')} s")
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"\nResults written to {args.json}")
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        stub_server.shutdown()
+
+if __name__ == "__main__":
+    main()
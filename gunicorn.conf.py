@@ -0,0 +1,59 @@
+"""
+Gunicorn configuration for Screenshot to Todoist
+
+Usage:
+    gunicorn -c gunicorn.conf.py
+    SERVE_MODE=asgi gunicorn -c gunicorn.conf.py
+
+SERVE_MODE=wsgi (the default) runs the Flask app on threaded workers, SERVE_MODE=asgi
+runs the async app on uvicorn workers, where one worker can keep hundreds of
+screenshots in flight while it waits on Claude and Todoist
+"""
+import os
+import shutil
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+# Async jobs, stored idempotent responses and the result cache live in the memory of one
+# process, so a single worker is the default; with more, GET /jobs/<id> and retries only
+# work when they reach the worker that handled the original request
+workers = int(os.getenv("GUNICORN_WORKERS", "1"))
+
+SERVE_MODE = os.getenv("SERVE_MODE", "wsgi").lower()
+if SERVE_MODE == "asgi":
+    wsgi_app = "screenshot_to_todoist_asgi:create_app()"
+    worker_class = "uvicorn.workers.UvicornWorker"
+else:
+    wsgi_app = "screenshot_to_todoist:create_app()"
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# Claude calls can take tens of seconds, so allow slow requests before a worker is killed
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+# Create the app once in the master and fork the workers from it; clients, pools and worker
+# threads are still created lazily in each worker, so nothing is shared across the fork
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() in ("true", "1", "yes")
+
+# Every worker writes its Prometheus samples to this directory so /metrics can aggregate
+# them; it has to be set before the workers import the application
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/screenshot_to_todoist_metrics")
+
+def reset_metrics_dir():
+    """Start with an empty metrics directory, samples from a previous run would be counted again"""
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+# With preload_app the master imports the application before on_starting would run, so the
+# directory is reset when this file is first loaded; a config reload (HUP) keeps the samples
+# of the running workers
+if not os.environ.get("SCREENSHOT_TO_TODOIST_METRICS_RESET"):
+    reset_metrics_dir()
+    os.environ["SCREENSHOT_TO_TODOIST_METRICS_RESET"] = "1"
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that exited"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,75 +1,486 @@
 #!/usr/bin/env python3
+import time
+
+# Taken before the other imports, so the startup timings include the cost of importing dependencies
+IMPORT_STARTED_AT = time.perf_counter()
+
 import os
 import sys
+import asyncio
 import base64
+import contextvars
 import json
 import logging
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import traceback
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+from flask import Blueprint, Flask, Request, Response, current_app, g, request, jsonify, send_from_directory, render_template_string
+from werkzeug.exceptions import NotFound, RequestEntityTooLarge
+from werkzeug.utils import safe_join
 import requests
+from requests.adapters import HTTPAdapter
+import anthropic
 from anthropic import Anthropic
 import httpx
 from dotenv import load_dotenv
 import io
-import time
+import gzip
+import mimetypes
+import mmap
+import tempfile
+import threading
+import uuid
+import hashlib
+import math
+import random
+import sqlite3
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
 
-# Ensure log directory exists with proper permissions
-LOG_DIR = '/var/log/screenshot_to_todoist'
+# resource is only available on Unix; it is used to report peak memory per request
 try:
-    os.makedirs(LOG_DIR, exist_ok=True)
-    os.chmod(LOG_DIR, 0o755)
-except Exception as e:
-    print(f"Error creating log directory: {e}", file=sys.stderr)
-    sys.exit(1)
-
-# Configure logging with more detailed format
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s',
-    handlers=[
-        logging.FileHandler(os.path.join(LOG_DIR, "flask_app.log")),
-        logging.StreamHandler(sys.stderr)
-    ]
-)
-logger = logging.getLogger(__name__)
+    import resource
+except ImportError:
+    resource = None
 
-# Load environment variables from .env file
+# Pillow is optional; without it the result cache only matches byte-identical images
+# and screenshots are sent to Claude without normalization
 try:
-    logger.info("Loading environment variables")
-    load_dotenv()
-except Exception as e:
-    logger.error(f"Error loading .env file: {e}")
-    sys.exit(1)
+    from PIL import Image, ImageChops, ImageOps
+except ImportError:
+    Image = None
 
-# Log startup information
-logger.info("Starting Screenshot to Todoist application")
-logger.info(f"Python version: {sys.version}")
-logger.info(f"Working directory: {os.getcwd()}")
+# Brotli is optional; without it the static pages are only precompressed with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
+# Load environment variables from .env file before anything reads its configuration
+# This stays at import time because the settings below are module-level constants; it only
+# reads the file, and a missing API key is reported by create_app()
 try:
-    logger.info("Importing Anthropic")
-    import anthropic
-    logger.info(f"Anthropic SDK Version: {anthropic.__version__}")
+    load_dotenv()
 except Exception as e:
-    logger.error(f"Error importing Anthropic: {e}")
-    sys.exit(1)
+    print(f"Error loading .env file: {e}", file=sys.stderr)
+
+# Logging configuration
+LOG_DIR = os.getenv("LOG_DIR", '/var/log/screenshot_to_todoist')
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MODE = os.getenv("LOG_MODE", "queue").lower()
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000"))
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.05"))
+
+class TruncatingFilter(logging.Filter):
+    """Cut off log messages that embed large payloads such as API response bodies"""
+    
+    def filter(self, record):
+        message = record.getMessage()
+        if len(message) > LOG_MAX_MESSAGE_CHARS:
+            record.msg = f"{message[:LOG_MAX_MESSAGE_CHARS]}... [truncated {len(message) - LOG_MAX_MESSAGE_CHARS} chars]"
+            record.args = None
+        return True
+
+class RequestLogBuffer:
+    """
+    Debug records of one request (or background job)
+    They are only written if the request fails or was picked by LOG_DEBUG_SAMPLE_RATE,
+    so successful requests do not pay for their debug logging
+    """
+    
+    max_records = 500
+    
+    def __init__(self):
+        self.sampled = random.random() < LOG_DEBUG_SAMPLE_RATE
+        self.records = []
+        self.failed = False
+        self.finished = False
+        self.lock = threading.Lock()
+    
+    def hold(self, record):
+        """Keep a debug record until the outcome is known; returns False if it should be written now"""
+        with self.lock:
+            if self.sampled or self.failed:
+                return False
+            if not self.finished and len(self.records) < self.max_records:
+                self.records.append(record)
+            return True
+    
+    def release(self, failed):
+        """Return the held records that should be written now"""
+        with self.lock:
+            records, self.records = self.records, []
+            if failed:
+                self.failed = True
+                return records
+            return []
+
+class RequestQueueHandler(QueueHandler):
+    """
+    Hands log records to a background listener thread so request threads never wait on disk
+    Holds back debug records of the current request until its outcome is known, and drops
+    records instead of blocking when the queue is full
+    """
+    
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.counters = {"dropped": 0, "sampled_out": 0, "released": 0}
+    
+    def emit(self, record):
+        # Called with the handler lock held, which also guards the counters
+        buffer = current_log_buffer.get()
+        if buffer is not None:
+            if record.levelno <= logging.DEBUG:
+                if buffer.hold(record):
+                    return
+            elif record.levelno >= logging.WARNING:
+                # A warning or error makes the request's debug records worth keeping
+                self.flush_buffer(buffer, failed=True)
+        super().emit(record)
+    
+    def flush_buffer(self, buffer, failed):
+        records = buffer.release(failed)
+        if failed:
+            self.counters["released"] += len(records)
+            for record in records:
+                super().emit(record)
+    
+    def finish(self, buffer, failed):
+        """Write or discard the held debug records of a finished request"""
+        with self.lock:
+            with buffer.lock:
+                buffer.finished = True
+                discarded = 0 if failed else len(buffer.records)
+            self.counters["sampled_out"] += discarded
+            self.flush_buffer(buffer, failed)
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.counters["dropped"] += 1
+    
+    def stats(self):
+        return dict(self.counters, queued=self.queue.qsize(), queue_size=LOG_QUEUE_SIZE,
+                    debug_sample_rate=LOG_DEBUG_SAMPLE_RATE)
+
+# Debug log buffer of the request (or background job) being processed in the current context
+current_log_buffer = contextvars.ContextVar("current_log_buffer", default=None)
 
-# Check for proxy settings in environment
+# Log handlers, set up by configure_logging()
+log_handlers = []
+log_queue_handler = None
+log_listener = None
+logging_lock = threading.Lock()
+
+def configure_logging():
+    """
+    Set up the log file, stderr and (in queue mode) the background log writer
+    Runs once per process from create_app(), so importing the module does not touch the log directory
+    """
+    global log_handlers, log_queue_handler
+    with logging_lock:
+        if log_handlers:
+            return
+        
+        # Ensure log directory exists with proper permissions
+        os.makedirs(LOG_DIR, exist_ok=True)
+        os.chmod(LOG_DIR, 0o755)
+        
+        # Configure logging with more detailed format
+        log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s')
+        handlers = [
+            RotatingFileHandler(os.path.join(LOG_DIR, "flask_app.log"), maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT),
+            logging.StreamHandler(sys.stderr)
+        ]
+        for handler in handlers:
+            handler.setFormatter(log_formatter)
+        log_handlers = handlers
+        
+        if LOG_MODE == "queue":
+            # Records are formatted and written by the listener thread
+            log_queue_handler = RequestQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+            log_queue_handler.addFilter(TruncatingFilter())
+            # Only the message is rendered here, otherwise basicConfig gives the handler its default
+            # format and the listener's formatter prefixes the level and logger name a second time
+            log_queue_handler.setFormatter(logging.Formatter('%(message)s'))
+            start_log_listener()
+            atexit.register(stop_log_listener)
+            os.register_at_fork(after_in_child=restart_log_listener)
+            logging.basicConfig(level=LOG_LEVEL, handlers=[log_queue_handler])
+        else:
+            for handler in handlers:
+                handler.addFilter(TruncatingFilter())
+            logging.basicConfig(level=LOG_LEVEL, handlers=handlers)
+
+def start_log_listener():
+    global log_listener
+    log_listener = QueueListener(log_queue_handler.queue, *log_handlers, respect_handler_level=True)
+    log_listener.start()
+
+def stop_log_listener():
+    if log_listener is not None:
+        log_listener.stop()
+
+def restart_log_listener():
+    # The listener thread does not survive a fork (e.g. when Gunicorn preloads the app), and
+    # the queue may have been locked by another thread of the parent at the time of the fork
+    log_queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    start_log_listener()
+
+logger = logging.getLogger(__name__)
+
+def start_request_logging():
+    """Start holding back the debug records of the current request or job"""
+    if log_queue_handler is None:
+        return None
+    buffer = RequestLogBuffer()
+    current_log_buffer.set(buffer)
+    return buffer
+
+def finish_request_logging(buffer, failed):
+    """Write the held debug records if the request failed, otherwise discard them"""
+    if buffer is not None:
+        log_queue_handler.finish(buffer, failed)
+
+# Proxy settings that interfere with the Anthropic SDK
 proxy_vars = ['http_proxy', 'https_proxy', 'HTTP_PROXY', 'HTTPS_PROXY']
-for var in proxy_vars:
-    if var in os.environ:
-        logger.warning(f"Found proxy setting in environment: {var}={os.environ[var]}")
 
-# Initialize Flask app
-app = Flask(__name__, static_folder='static')
+# Prometheus metrics
+# Under multi-worker Gunicorn, set PROMETHEUS_MULTIPROC_DIR so every worker writes its
+# samples to a shared directory and /metrics aggregates them (see gunicorn.conf.py)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_LATENCY = Histogram(
+    "screenshot_stage_duration_seconds",
+    "Time spent in each stage of processing a screenshot",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+SCREENSHOT_REQUESTS = Counter(
+    "screenshot_requests_total",
+    "Screenshots processed, by outcome",
+    ["outcome"]
+)
+ATTACHMENT_FALLBACKS = Counter(
+    "screenshot_attachment_fallbacks_total",
+    "Attachment uploads that had to fall back to another upload path",
+    ["reason"]
+)
+TASK_PARSE_FAILURES = Counter(
+    "screenshot_task_parse_failures_total",
+    "Claude replies without a usable task (no 'XY: Title' line, or tool input that does not match the schema)"
+)
+CLAUDE_TOKENS = Counter(
+    "claude_tokens_total",
+    "Tokens reported in Claude's usage, by type",
+    ["type"]
+)
+RESULT_CACHE_LOOKUPS = Counter(
+    "screenshot_result_cache_lookups_total",
+    "Result cache lookups, by result",
+    ["result"]
+)
+TODOIST_RETRIES = Counter(
+    "todoist_request_retries_total",
+    "Todoist API calls that were retried"
+)
+TODOIST_SYNC_BATCH_COMMANDS = Histogram(
+    "todoist_sync_batch_commands",
+    "Commands per coalesced Todoist Sync API request",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 100)
+)
+CLAUDE_TIER_LATENCY = Histogram(
+    "claude_tier_duration_seconds",
+    "Latency of Claude analysis calls, by model tier",
+    ["model"],
+    buckets=LATENCY_BUCKETS
+)
+CLAUDE_TIER_CALLS = Counter(
+    "claude_tier_calls_total",
+    "Claude analysis calls by model tier and whether the reply was accepted or escalated",
+    ["model", "outcome"]
+)
+ATTACHMENT_BYTES_SAVED = Counter(
+    "screenshot_attachment_bytes_saved_total",
+    "Screenshot bytes not sent to the REST attachment endpoint while its circuit breaker was open"
+)
+CLIENT_UPLOAD_BYTES = Counter(
+    "screenshot_client_upload_bytes_total",
+    "Size of screenshots resized in the browser, before (original) and after (uploaded) resizing",
+    ["kind"]
+)
+STATIC_RESPONSES = Counter(
+    "static_page_responses_total",
+    "Static pages served from memory, by content encoding and status",
+    ["encoding", "status"]
+)
+# Every worker reads the same outbox database, so the largest value is the current one
+OUTBOX_DEPTH = Gauge(
+    "todoist_outbox_depth",
+    "Tasks waiting in the outbox to be created in Todoist",
+    multiprocess_mode="livemax"
+)
+OUTBOX_OLDEST_AGE = Gauge(
+    "todoist_outbox_oldest_age_seconds",
+    "Age of the oldest task waiting in the outbox",
+    multiprocess_mode="livemax"
+)
+OUTBOX_DELIVERIES = Counter(
+    "todoist_outbox_deliveries_total",
+    "Outbox delivery attempts, by outcome",
+    ["outcome"]
+)
+OUTBOUND_CONCURRENCY_LIMIT = Gauge(
+    "outbound_concurrency_limit",
+    "Current adaptive limit of concurrent calls per upstream API, summed over workers",
+    ["upstream"],
+    multiprocess_mode="livesum"
+)
+OUTBOUND_RATE_LIMIT = Gauge(
+    "outbound_rate_limit_per_second",
+    "Configured token bucket rate per upstream API, summed over workers",
+    ["upstream"],
+    multiprocess_mode="livesum"
+)
+OUTBOUND_IN_FLIGHT = Gauge(
+    "outbound_in_flight",
+    "Calls to each upstream API that are currently in flight",
+    ["upstream"],
+    multiprocess_mode="livesum"
+)
+OUTBOUND_QUEUE_WAIT = Histogram(
+    "outbound_queue_wait_seconds",
+    "Time calls waited for a token and a concurrency slot, per upstream API",
+    ["upstream"],
+    buckets=LATENCY_BUCKETS
+)
+OUTBOUND_CONGESTION = Counter(
+    "outbound_congestion_total",
+    "Upstream congestion signals: 429/503/529 responses and calls rejected after waiting too long",
+    ["upstream", "reason"]
+)
+
+class RequestTimings:
+    """
+    Stage durations of a single request, reported in the Server-Timing header
+    and as a waterfall in debug responses
+    """
+    
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.stages = []
+        self.lock = threading.Lock()
+    
+    def record(self, stage, start_time, end_time):
+        with self.lock:
+            self.stages.append({
+                "stage": stage,
+                "start_ms": round((start_time - self.start_time) * 1000, 1),
+                "duration_ms": round((end_time - start_time) * 1000, 1)
+            })
+    
+    def as_dict(self):
+        with self.lock:
+            stages = sorted(self.stages, key=lambda entry: entry["start_ms"])
+        return {
+            "total_ms": round((time.perf_counter() - self.start_time) * 1000, 1),
+            "stages": stages
+        }
+    
+    def server_timing(self):
+        """Format the stages as a Server-Timing header value, summing repeated stages"""
+        totals = OrderedDict()
+        with self.lock:
+            for entry in self.stages:
+                totals[entry["stage"]] = totals.get(entry["stage"], 0.0) + entry["duration_ms"]
+        totals["app"] = (time.perf_counter() - self.start_time) * 1000
+        return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in totals.items())
+
+# Timings of the request (or background job) being processed in the current context
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+@contextmanager
+def stage_timer(stage):
+    """Record how long the wrapped block takes in the stage latency histogram and the request's timings"""
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_time = time.perf_counter()
+        STAGE_LATENCY.labels(stage=stage).observe(end_time - start_time)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.record(stage, start_time, end_time)
+
+# Upload ingest configuration
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(512 * 1024)))
+
+class SpoolingRequest(Request):
+    """
+    Request that writes large uploads straight to an unnamed temporary file,
+    so ingest_upload() can memory-map them instead of reading them into the heap
+    """
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length > UPLOAD_SPOOL_THRESHOLD:
+            return tempfile.TemporaryFile("w+b")
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_THRESHOLD, mode="w+b")
+
+# Routes, hooks and error handlers; registered on the Flask app by create_app()
+routes = Blueprint("screenshot_to_todoist", __name__)
+
+@routes.before_app_request
+def start_request_timings():
+    current_timings.set(RequestTimings())
+    # Worker threads are reused, so clear the previous request's idempotency key
+    current_idempotency_key.set(None)
+    g.log_buffer = start_request_logging()
+
+@routes.before_app_request
+def record_first_request():
+    if startup_timings["first_request_seconds"] is None:
+        with startup_lock:
+            if startup_timings["first_request_seconds"] is None:
+                startup_timings["first_request_seconds"] = round(time.perf_counter() - process_started_at, 3)
+                logger.info(f"First request after {startup_timings['first_request_seconds']:.3f}s")
+
+@routes.before_app_request
+def start_outbox_drainer():
+    # Start draining tasks left in the outbox as soon as this process serves its first request
+    if OUTBOX_MODE != "off":
+        get_outbox()
+
+@routes.after_app_request
+def add_server_timing(response):
+    timings = current_timings.get()
+    if timings is not None:
+        response.headers["Server-Timing"] = timings.server_timing()
+    finish_request_logging(g.get("log_buffer"), failed=response.status_code >= 400)
+    return response
+
+@routes.app_errorhandler(RequestEntityTooLarge)
+def handle_upload_too_large(error):
+    logger.warning(f"Rejected upload larger than {MAX_UPLOAD_BYTES} bytes")
+    return jsonify({"error": f"Upload exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes"}), 413
 
 # Error handler for all exceptions
-@app.errorhandler(Exception)
+@routes.app_errorhandler(Exception)
 def handle_error(error):
     logger.error(f"Unhandled error: {str(error)}")
     logger.error(traceback.format_exc())
     error_id = os.urandom(8).hex()
     error_message = f"Error ID: {error_id}. Please check the application logs for more details."
+    if isinstance(error, UpstreamBusyError):
+        return upstream_busy_response(error)
     if isinstance(error, httpx.TimeoutException):
         return jsonify({"error": "Request timed out", "error_id": error_id}), 504
     elif isinstance(error, httpx.ConnectError):
@@ -82,59 +493,1785 @@ def handle_error(error):
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 TODOIST_API_KEY = os.getenv("TODOIST_API_KEY")
 
-if not ANTHROPIC_API_KEY:
-    logger.error("ANTHROPIC_API_KEY is not set in environment variables")
-    sys.exit(1)
-
-if not TODOIST_API_KEY:
-    logger.error("TODOIST_API_KEY is not set in environment variables")
-    sys.exit(1)
+_anthropic_client = None
+_anthropic_client_pid = None
+_anthropic_client_lock = threading.Lock()
 
-# Initialize Anthropic client with proper configuration
-try:
-    logger.debug("Attempting to initialize Anthropic client...")
-    # Check for any proxy environment variables
+def clear_proxy_env():
+    """Remove proxy environment variables that interfere with the Anthropic SDK, used by both apps"""
     for var in proxy_vars:
         if var in os.environ:
             logger.warning(f"Found proxy setting in environment: {var}={os.environ[var]}")
             # Temporarily unset any proxy variables that might interfere with Anthropic SDK
-            proxy_value = os.environ.pop(var)
+            os.environ.pop(var)
             logger.warning(f"Temporarily removed {var} from environment")
+
+def get_anthropic_client():
+    """Return the shared Anthropic client, creating it on first use in each process"""
+    global _anthropic_client, _anthropic_client_pid
+    with _anthropic_client_lock:
+        # Connection pools must not be shared with a parent process after a fork
+        if _anthropic_client is None or _anthropic_client_pid != os.getpid():
+            logger.debug("Attempting to initialize Anthropic client...")
+            clear_proxy_env()
+            
+            # Initialize with just the API key
+            try:
+                _anthropic_client = Anthropic(api_key=ANTHROPIC_API_KEY)
+            except Exception as e:
+                logger.error(f"Error initializing Anthropic client: {str(e)}")
+                logger.error(f"Error type: {type(e).__name__}")
+                logger.error(f"Traceback:\n{traceback.format_exc()}")
+                raise
+            _anthropic_client_pid = os.getpid()
+            logger.info("Successfully initialized Anthropic client")
+        return _anthropic_client
+
+# Outbound rate limiting configuration
+# Limits apply per worker process, so divide the API's rate limit by the number of workers
+OUTBOUND_LIMITS = os.getenv("OUTBOUND_LIMITS", "true").lower() == "true"
+OUTBOUND_QUEUE_TIMEOUT = float(os.getenv("OUTBOUND_QUEUE_TIMEOUT", "5"))
+ANTHROPIC_RATE_LIMIT = float(os.getenv("ANTHROPIC_RATE_LIMIT", "2"))
+ANTHROPIC_BURST = int(os.getenv("ANTHROPIC_BURST", "10"))
+ANTHROPIC_MAX_CONCURRENCY = int(os.getenv("ANTHROPIC_MAX_CONCURRENCY", "32"))
+ANTHROPIC_LATENCY_TARGET = float(os.getenv("ANTHROPIC_LATENCY_TARGET", "30"))
+TODOIST_RATE_LIMIT = float(os.getenv("TODOIST_RATE_LIMIT", "2"))
+TODOIST_BURST = int(os.getenv("TODOIST_BURST", "20"))
+TODOIST_MAX_CONCURRENCY = int(os.getenv("TODOIST_MAX_CONCURRENCY", "10"))
+TODOIST_LATENCY_TARGET = float(os.getenv("TODOIST_LATENCY_TARGET", "10"))
+
+# Responses that mean the upstream is overloaded: rate limited, unavailable or (Anthropic) overloaded
+CONGESTION_STATUS_CODES = {429, 503, 529}
+
+class UpstreamBusyError(Exception):
+    """An upstream API is rate limiting us, or no call slot became free in time"""
     
-    # Initialize with just the API key
-    client = Anthropic(api_key=ANTHROPIC_API_KEY)
-    logger.info("Successfully initialized Anthropic client")
-except Exception as e:
-    logger.error(f"Error initializing Anthropic client: {str(e)}")
-    logger.error(f"Error type: {type(e).__name__}")
-    logger.error(f"Traceback:\n{traceback.format_exc()}")
-    sys.exit(1)
+    def __init__(self, upstream, retry_after):
+        super().__init__(f"Too many requests to {upstream}, please retry in {retry_after}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+    
+    @classmethod
+    def from_response(cls, upstream, response):
+        """Build the error for a rate-limited upstream response, passing on its Retry-After"""
+        retry_after = TodoistClient._retry_after(response)
+        return cls(upstream, max(1, math.ceil(retry_after)) if retry_after is not None else 5)
+
+class OutboundCall:
+    """A call holding a slot of an OutboundLimiter; set status_code to the upstream's response status"""
+    
+    def __init__(self):
+        self.status_code = None
+
+class OutboundLimiter:
+    """
+    Token bucket and adaptive concurrency limit for the calls to one upstream API
+    The concurrency limit grows by one per limit's worth of fast successful calls and is halved
+    when the upstream answers 429/503/529 or is slower than the latency target (AIMD).
+    Calls wait up to OUTBOUND_QUEUE_TIMEOUT seconds for a token and a free slot, after which
+    UpstreamBusyError is raised so the client can be told to retry later
+    """
+    
+    # Halve the limit at most once per interval, so a burst of 429s counts as one congestion signal
+    decrease_interval = 1.0
+    # How often a waiting call checks for a free slot
+    poll_interval = 0.02
+    
+    def __init__(self, upstream, rate, burst, max_concurrency, latency_target, enabled=OUTBOUND_LIMITS):
+        self.upstream = upstream
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.latency_target = latency_target
+        self.enabled = enabled
+        self.tokens = float(burst)
+        self.refilled_at = time.monotonic()
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.decreased_at = 0.0
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "rejected": 0, "congested": 0, "slow": 0, "decreases": 0}
+        OUTBOUND_RATE_LIMIT.labels(upstream=upstream).set(rate if enabled else 0)
+        OUTBOUND_CONCURRENCY_LIMIT.labels(upstream=upstream).set(max_concurrency if enabled else 0)
+    
+    def try_acquire(self):
+        """Take a token and a slot if both are available; returns 0, or the seconds to wait before trying again"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.in_flight >= int(self.limit):
+                return self.poll_interval
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            self.in_flight += 1
+            self.counters["calls"] += 1
+        OUTBOUND_IN_FLIGHT.labels(upstream=self.upstream).inc()
+        return 0
+    
+    def acquire(self, timeout=OUTBOUND_QUEUE_TIMEOUT):
+        """Wait for a token and a slot, raising UpstreamBusyError after timeout seconds"""
+        start_time = time.monotonic()
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                OUTBOUND_QUEUE_WAIT.labels(upstream=self.upstream).observe(time.monotonic() - start_time)
+                return
+            remaining = start_time + timeout - time.monotonic()
+            if remaining <= 0:
+                raise self.busy()
+            time.sleep(min(wait, remaining))
+    
+    async def acquire_async(self, timeout=OUTBOUND_QUEUE_TIMEOUT):
+        """acquire() for the event loop"""
+        start_time = time.monotonic()
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                OUTBOUND_QUEUE_WAIT.labels(upstream=self.upstream).observe(time.monotonic() - start_time)
+                return
+            remaining = start_time + timeout - time.monotonic()
+            if remaining <= 0:
+                raise self.busy()
+            await asyncio.sleep(min(wait, remaining))
+    
+    def release(self, latency, congested):
+        """Free the slot of a finished call and adjust the concurrency limit to how the upstream coped"""
+        slow = latency > self.latency_target
+        with self.lock:
+            self.in_flight -= 1
+            if congested or slow:
+                self.counters["congested" if congested else "slow"] += 1
+                if congested:
+                    # Stop sending until the bucket has refilled a little
+                    self.tokens = min(self.tokens, 0.0)
+                now = time.monotonic()
+                if now - self.decreased_at >= self.decrease_interval:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.decreased_at = now
+                    self.counters["decreases"] += 1
+            else:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            limit = int(self.limit)
+        OUTBOUND_IN_FLIGHT.labels(upstream=self.upstream).dec()
+        OUTBOUND_CONCURRENCY_LIMIT.labels(upstream=self.upstream).set(limit)
+        if congested:
+            OUTBOUND_CONGESTION.labels(upstream=self.upstream, reason="upstream").inc()
+    
+    def busy(self):
+        """Build the UpstreamBusyError for a call that could not be sent in time"""
+        with self.lock:
+            self.counters["rejected"] += 1
+            # A rough estimate of when the next token is available
+            retry_after = max(1, math.ceil((1 - min(self.tokens, 1.0)) / self.rate))
+        OUTBOUND_CONGESTION.labels(upstream=self.upstream, reason="queue_timeout").inc()
+        logger.warning(f"No {self.upstream} call slot became free in time, rejecting the call")
+        return UpstreamBusyError(self.upstream, retry_after)
+    
+    @contextmanager
+    def call(self):
+        """Hold a slot for one upstream call"""
+        if not self.enabled:
+            yield OutboundCall()
+            return
+        # Time the wait as its own stage, so it is not counted as the upstream's latency
+        with stage_timer(f"{self.upstream}_queue"):
+            self.acquire()
+        outbound_call = OutboundCall()
+        start_time = time.perf_counter()
+        try:
+            yield outbound_call
+        except Exception as e:
+            outbound_call.status_code = getattr(e, "status_code", None)
+            raise
+        finally:
+            self.release(time.perf_counter() - start_time, outbound_call.status_code in CONGESTION_STATUS_CODES)
+    
+    @asynccontextmanager
+    async def call_async(self):
+        """call() for the event loop"""
+        if not self.enabled:
+            yield OutboundCall()
+            return
+        with stage_timer(f"{self.upstream}_queue"):
+            await self.acquire_async()
+        outbound_call = OutboundCall()
+        start_time = time.perf_counter()
+        try:
+            yield outbound_call
+        except Exception as e:
+            outbound_call.status_code = getattr(e, "status_code", None)
+            raise
+        finally:
+            self.release(time.perf_counter() - start_time, outbound_call.status_code in CONGESTION_STATUS_CODES)
+    
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, enabled=self.enabled, concurrency_limit=int(self.limit),
+                        max_concurrency=self.max_concurrency, in_flight=self.in_flight,
+                        rate_per_second=self.rate, burst=self.burst, tokens=round(self.tokens, 2))
+
+outbound_limiters = {
+    "anthropic": OutboundLimiter("anthropic", ANTHROPIC_RATE_LIMIT, ANTHROPIC_BURST,
+                                 ANTHROPIC_MAX_CONCURRENCY, ANTHROPIC_LATENCY_TARGET),
+    "todoist": OutboundLimiter("todoist", TODOIST_RATE_LIMIT, TODOIST_BURST,
+                               TODOIST_MAX_CONCURRENCY, TODOIST_LATENCY_TARGET)
+}
+
+def upstream_busy_response(error):
+    """503 response with Retry-After for an UpstreamBusyError"""
+    response = jsonify({"error": str(error), "upstream": error.upstream})
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, 503
+
+# Todoist HTTP client configuration
+TODOIST_API_BASE = os.getenv("TODOIST_API_BASE", "https://api.todoist.com").rstrip("/")
+TODOIST_POOL_SIZE = int(os.getenv("TODOIST_POOL_SIZE", "10"))
+TODOIST_CONNECT_TIMEOUT = float(os.getenv("TODOIST_CONNECT_TIMEOUT", "5"))
+TODOIST_READ_TIMEOUT = float(os.getenv("TODOIST_READ_TIMEOUT", "30"))
+TODOIST_MAX_RETRIES = int(os.getenv("TODOIST_MAX_RETRIES", "3"))
+TODOIST_BACKOFF_BASE = float(os.getenv("TODOIST_BACKOFF_BASE", "0.5"))
+TODOIST_BACKOFF_MAX = float(os.getenv("TODOIST_BACKOFF_MAX", "10"))
+TODOIST_RETRY_AFTER_MAX = float(os.getenv("TODOIST_RETRY_AFTER_MAX", "30"))
+# Total time a call may spend on attempts and waits, kept below the proxy's 60s timeout
+TODOIST_RETRY_BUDGET = float(os.getenv("TODOIST_RETRY_BUDGET", "20"))
+
+# Responses worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class TodoistClient:
+    """
+    Process-wide Todoist API client
+    Reuses keep-alive connections from a pool and retries rate-limited and failed
+    calls with jittered exponential backoff, honouring Retry-After
+    """
+    
+    def __init__(self, api_key, base_url=TODOIST_API_BASE, pool_size=TODOIST_POOL_SIZE,
+                 timeout=(TODOIST_CONNECT_TIMEOUT, TODOIST_READ_TIMEOUT), max_retries=TODOIST_MAX_RETRIES):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.pid = os.getpid()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        self.session.headers["Authorization"] = f"Bearer {api_key}"
+        self.lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "errors": 0}
+    
+    def request(self, method, path, request_id=None, max_retries=None, **kwargs):
+        """
+        Send a request to the Todoist API, retrying transient failures
+        request_id is sent as X-Request-Id so Todoist can deduplicate retried writes
+        max_retries overrides the client's retry limit for this call
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        headers = dict(kwargs.pop("headers", None) or {})
+        if request_id:
+            headers["X-Request-Id"] = request_id
+        
+        attempt = 0
+        deadline = time.monotonic() + TODOIST_RETRY_BUDGET
+        while True:
+            self._count("requests")
+            # Streamed bodies have to be rewound before they can be sent again
+            if hasattr(kwargs.get("data"), "seek"):
+                kwargs["data"].seek(0)
+            try:
+                with outbound_limiters["todoist"].call() as outbound_call:
+                    response = self.session.request(method, url, headers=headers, timeout=self.timeout, **kwargs)
+                    outbound_call.status_code = response.status_code
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._count("errors")
+                delay = self._backoff(attempt)
+                if attempt >= max_retries or time.monotonic() + delay > deadline:
+                    raise
+                logger.warning(f"Todoist {method} {path} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= max_retries:
+                    return response
+                retry_after = self._retry_after(response)
+                if retry_after is not None and retry_after > TODOIST_RETRY_AFTER_MAX:
+                    logger.warning(f"Todoist asked to retry {method} {path} after {retry_after}s, giving up")
+                    return response
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                if time.monotonic() + delay > deadline:
+                    # Hand the rate limit to the caller (503 or the outbox) before the proxy times out
+                    logger.warning(f"Todoist {method} {path} returned {response.status_code}, giving up as retrying in {delay:.2f}s exceeds the {TODOIST_RETRY_BUDGET}s retry budget")
+                    return response
+                logger.warning(f"Todoist {method} {path} returned {response.status_code}, retrying in {delay:.2f}s")
+            
+            self._count("retries")
+            TODOIST_RETRIES.inc()
+            attempt += 1
+            time.sleep(delay)
+    
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+    
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+    
+    def stats(self):
+        """Report request counters and how many connections the pool had to open"""
+        connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+        with self.lock:
+            counters = dict(self.counters)
+        sent = counters["requests"] - counters["errors"]
+        counters.update({
+            "connections_opened": connections,
+            "connections_reused": max(0, sent - connections),
+            "pool_maxsize": self.pool_size
+        })
+        return counters
+    
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+    
+    @staticmethod
+    def _backoff(attempt):
+        # Full jitter keeps concurrent retries from hitting Todoist in lockstep
+        return random.uniform(0, min(TODOIST_BACKOFF_MAX, TODOIST_BACKOFF_BASE * (2 ** attempt)))
+    
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+_todoist_client = None
+_todoist_client_lock = threading.Lock()
+
+def get_todoist_client():
+    """Return the shared Todoist client, creating it on first use in each process"""
+    global _todoist_client
+    with _todoist_client_lock:
+        # Connection pools must not be shared with a parent process after a fork
+        if _todoist_client is None or _todoist_client.pid != os.getpid():
+            _todoist_client = TodoistClient(TODOIST_API_KEY)
+        return _todoist_client
+
+# Todoist write coalescing configuration
+TODOIST_SYNC_BATCHING = os.getenv("TODOIST_SYNC_BATCHING", "true").lower() == "true"
+TODOIST_SYNC_BATCH_WINDOW = float(os.getenv("TODOIST_SYNC_BATCH_WINDOW", "0.05"))
+TODOIST_SYNC_BATCH_MAX_COMMANDS = int(os.getenv("TODOIST_SYNC_BATCH_MAX_COMMANDS", "100"))
+TODOIST_SYNC_BATCH_CONCURRENCY = int(os.getenv("TODOIST_SYNC_BATCH_CONCURRENCY", "4"))
+
+class TodoistSyncError(Exception):
+    """The Todoist Sync API rejected a whole batch of commands"""
+
+class SyncCommandBatcher:
+    """
+    Coalesces Todoist writes from concurrent requests into Sync API batches
+    Commands are collected for TODOIST_SYNC_BATCH_WINDOW seconds after the first one arrives
+    (or until the batch is full) and sent as one /sync/v9/sync request; every caller gets a
+    future with the status of its own commands and the ids of its temp ids
+    """
+    
+    def __init__(self, window=TODOIST_SYNC_BATCH_WINDOW, max_commands=TODOIST_SYNC_BATCH_MAX_COMMANDS,
+                 concurrency=TODOIST_SYNC_BATCH_CONCURRENCY):
+        self.window = window
+        self.max_commands = max_commands
+        self.pid = os.getpid()
+        self.pending = []
+        self.pending_commands = 0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="todoist-sync")
+        self.counters = {"batches": 0, "commands": 0, "submissions": 0, "failed_batches": 0}
+    
+    def submit(self, commands):
+        """Queue commands for the next batch; returns a future of their sync status and temp id mapping"""
+        future = Future()
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="todoist-sync-batcher", daemon=True)
+                self.thread.start()
+            self.pending.append((commands, future))
+            self.pending_commands += len(commands)
+            self.counters["submissions"] += 1
+            self.condition.notify()
+        return future
+    
+    def stats(self):
+        with self.condition:
+            counters = dict(self.counters, pending_commands=self.pending_commands)
+        counters["commands_per_batch"] = round(counters["commands"] / counters["batches"], 2) if counters["batches"] else 0.0
+        return counters
+    
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                # Give other requests a moment to add their commands to the batch
+                deadline = time.monotonic() + self.window
+                while self.pending_commands < self.max_commands:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self._take_batch()
+            self.executor.submit(self._send, batch)
+    
+    def _take_batch(self):
+        # Submissions are never split, so the commands of one request end up in the same batch
+        batch, count = [], 0
+        while self.pending and (not batch or count + len(self.pending[0][0]) <= self.max_commands):
+            commands, future = self.pending.pop(0)
+            batch.append((commands, future))
+            count += len(commands)
+        self.pending_commands -= count
+        return batch
+    
+    def _send(self, batch):
+        commands = [command for submission, _ in batch for command in submission]
+        TODOIST_SYNC_BATCH_COMMANDS.observe(len(commands))
+        with self.condition:
+            self.counters["batches"] += 1
+            self.counters["commands"] += len(commands)
+        logger.debug(f"Sending {len(commands)} Sync API commands from {len(batch)} requests")
+        
+        try:
+            # Commands carry a uuid, so Todoist ignores the ones it already applied when a batch is retried
+            start_time = time.perf_counter()
+            response = get_todoist_client().post("/sync/v9/sync", data={"commands": json.dumps(commands)})
+            STAGE_LATENCY.labels(stage="todoist_sync_batch_request").observe(time.perf_counter() - start_time)
+            if response.status_code != 200:
+                raise TodoistSyncError(f"Todoist Sync API error: {response.status_code} - {response.text}")
+            result = response.json()
+        except Exception as e:
+            logger.error(f"Sync API batch of {len(commands)} commands failed: {str(e)}")
+            with self.condition:
+                self.counters["failed_batches"] += 1
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        
+        sync_status = result.get("sync_status", {})
+        temp_id_mapping = result.get("temp_id_mapping", {})
+        for submission, future in batch:
+            future.set_result({
+                "sync_status": {command["uuid"]: sync_status.get(command["uuid"]) for command in submission},
+                "temp_id_mapping": {command["temp_id"]: temp_id_mapping.get(command["temp_id"])
+                                    for command in submission if command.get("temp_id")}
+            })
+
+_sync_batcher = None
+_sync_batcher_lock = threading.Lock()
+
+def get_sync_batcher():
+    """Return the shared Sync API command batcher, creating it on first use in each process"""
+    global _sync_batcher
+    with _sync_batcher_lock:
+        # The batching thread does not survive a fork
+        if _sync_batcher is None or _sync_batcher.pid != os.getpid():
+            _sync_batcher = SyncCommandBatcher()
+        return _sync_batcher
+
+# Claude model used for task analysis
+CLAUDE_MODEL = os.getenv("CLAUDE_MODEL", "claude-3-sonnet-20240229")
+# The reply is a single short line, so a tight output limit keeps Claude from spending time on
+# explanations after it. There are no stop sequences by default: a blank line can come between a
+# preamble and the task line, and streamed replies are cut off after the task line anyway
+CLAUDE_MAX_TOKENS = int(os.getenv("CLAUDE_MAX_TOKENS", "60"))
+CLAUDE_STOP_SEQUENCES = [value.encode().decode("unicode_escape") for value in
+                         os.getenv("CLAUDE_STOP_SEQUENCES", "").split(",") if value]
+
+# Stream replies and stop reading as soon as the task line has arrived
+CLAUDE_STREAMING = os.getenv("CLAUDE_STREAMING", "true").lower() == "true"
+
+# Output format of the analysis: "tool" makes Claude fill in the create_task tool, so the reply
+# has a fixed shape and size and needs no text parsing; "text" asks for the "XY: Title" line,
+# which is also used when a tool reply is unusable
+CLAUDE_OUTPUT_MODE = os.getenv("CLAUDE_OUTPUT_MODE", "tool").lower()
+if CLAUDE_OUTPUT_MODE not in ("tool", "text"):
+    print(f"Unknown CLAUDE_OUTPUT_MODE {CLAUDE_OUTPUT_MODE!r}, using text", file=sys.stderr)
+    CLAUDE_OUTPUT_MODE = "text"
+# The tool input is a small JSON object, this leaves room for the optional fields
+CLAUDE_TOOL_MAX_TOKENS = int(os.getenv("CLAUDE_TOOL_MAX_TOKENS", "100"))
+
+# Models to try in order, cheapest first; a reply that fails validation is escalated to the next
+# model and the last model's reply is always used. CLAUDE_MODEL_TIERS=<CLAUDE_MODEL> disables routing
+CLAUDE_MODEL_TIERS = [model.strip() for model in
+                      os.getenv("CLAUDE_MODEL_TIERS", f"claude-3-haiku-20240307,{CLAUDE_MODEL}").split(",")
+                      if model.strip()] or [CLAUDE_MODEL]
+CLAUDE_MAX_TITLE_WORDS = int(os.getenv("CLAUDE_MAX_TITLE_WORDS", "12"))
+
+model_routing_totals = {}
+model_routing_lock = threading.Lock()
 
 # Claude prompt for task analysis
-CLAUDE_PROMPT = """
+# The fixed instructions are sent as the system prompt so they form the same prefix on every
+# request, which Anthropic's prompt cache could serve once it is long enough (see
+# CLAUDE_PROMPT_CACHE); the per-request instructions and the image follow in the user message
+CLAUDE_SYSTEM_PROMPT = """
 Below is a screenshot of something that needs to be turned into a task that I need to do and I want to add to my todo list. Please analyze the image and determine the task's title in no more than 5-7 words. Also, estimate the required time to complete this task and express it in a two-digit format where the first digit is the number of hours and the second digit is the number of tens of minutes (e.g., '02' means 0 hours and 20 minutes). Return your answer strictly in the following format:
-Here are some additional instructions that you can use to help you:
-{additional_instructions}
 
 XY: *Title of Task*
 
 For example, if the task takes 20 minutes and is 'Buy groceries', you should output:
 02: Buy groceries
 
+The user will send the screenshot together with additional instructions that you can use to help you.
+""".strip()
+
+CLAUDE_USER_PROMPT = """
+Here are some additional instructions that you can use to help you:
+{additional_instructions}
+
+Now, please analyze the image and provide the result. Reply with only the task line.
+""".strip()
+
+# Prompts and tool for CLAUDE_OUTPUT_MODE=tool; the tool definition is part of the cached prefix
+CLAUDE_TOOL_SYSTEM_PROMPT = """
+Below is a screenshot of something that needs to be turned into a task that I need to do and I want to add to my todo list. Please analyze the image, determine the task's title in no more than 5-7 words and estimate the time required to complete it in minutes. Only set a priority or labels if the screenshot makes them clear. Record the task with the create_task tool.
+
+The user will send the screenshot together with additional instructions that you can use to help you.
+""".strip()
+
+CLAUDE_TOOL_USER_PROMPT = """
+Here are some additional instructions that you can use to help you:
+{additional_instructions}
+
+Now, please analyze the image and create the task.
+""".strip()
+
+CLAUDE_TASK_TOOL = {
+    "name": "create_task",
+    "description": "Add the task shown in the screenshot to the todo list",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "title": {"type": "string", "description": "Title of the task in no more than 5-7 words"},
+            "estimated_minutes": {"type": "integer", "description": "Estimated time to complete the task in minutes"},
+            "priority": {"type": "integer", "enum": [1, 2, 3, 4],
+                         "description": "Priority from 1 (normal) to 4 (urgent)"},
+            "labels": {"type": "array", "items": {"type": "string"}, "maxItems": 3,
+                       "description": "Short labels for the kind of task, such as errand or email"}
+        },
+        "required": ["title", "estimated_minutes"]
+    }
+}
+# Optional tool fields that are passed on to the Todoist task as they are
+TODOIST_TASK_FIELDS = ("priority", "labels")
+
+# Mark the system prompt as cacheable. Off by default: the system prompt is far shorter than
+# the model's minimum cacheable length (1024 tokens for Sonnet and Opus, 2048 for Haiku), so
+# Anthropic would process it without caching anyway
+CLAUDE_PROMPT_CACHE = os.getenv("CLAUDE_PROMPT_CACHE", "false").lower() == "true"
 
-Now, please analyze the following image and provide the result.
-"""
+# Async job mode configuration
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "32"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "3600"))
 
-@app.route('/')
+# Parallel attachment upload configuration
+PARALLEL_UPLOAD = os.getenv("PARALLEL_UPLOAD", "true").lower() == "true"
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))
+
+# Worker pool for Todoist uploads that run while Claude analyzes the image
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="todoist-upload")
+
+# REST attachment circuit breaker configuration
+ATTACHMENT_BREAKER = os.getenv("ATTACHMENT_BREAKER", "true").lower() == "true"
+ATTACHMENT_BREAKER_THRESHOLD = int(os.getenv("ATTACHMENT_BREAKER_THRESHOLD", "2"))
+ATTACHMENT_BREAKER_PROBE_INTERVAL = float(os.getenv("ATTACHMENT_BREAKER_PROBE_INTERVAL", "600"))
+
+class AttachmentBreaker:
+    """
+    Circuit breaker for attaching screenshots with the REST attachments endpoint
+    After ATTACHMENT_BREAKER_THRESHOLD REST attachments in a row were rejected, screenshots
+    go straight to the Sync API upload instead of being uploaded twice. Every
+    ATTACHMENT_BREAKER_PROBE_INTERVAL seconds one request probes the REST endpoint again
+    (half-open), and a successful probe sends traffic back to it
+    """
+    
+    def __init__(self, threshold=ATTACHMENT_BREAKER_THRESHOLD, probe_interval=ATTACHMENT_BREAKER_PROBE_INTERVAL,
+                 enabled=ATTACHMENT_BREAKER):
+        self.threshold = threshold
+        self.probe_interval = probe_interval
+        self.enabled = enabled
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+        self.counters = {"rest_successes": 0, "rest_failures": 0, "probes": 0, "skipped": 0, "bytes_saved": 0}
+    
+    def allow_rest(self, size, count_skip=True):
+        """
+        Whether to try the REST attachment endpoint for an upload of size bytes
+        When it is skipped, the upload that would have been wasted is counted as saved, unless
+        count_skip is False because skip_rest() already counted it for this request
+        """
+        if not self.enabled:
+            return True
+        with self.lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.probe_interval:
+                # Let this request probe the REST endpoint; others keep using the Sync API meanwhile
+                self.state = "half_open"
+                self.counters["probes"] += 1
+                logger.info("Probing the REST attachment endpoint again")
+                return True
+        if count_skip:
+            self._count_skip(size)
+        return False
+    
+    def skip_rest(self, size):
+        """
+        Whether an upload of size bytes should go straight to the Sync API, without changing state
+        Returns False when a probe is due, so the request can take the REST path and probe it
+        """
+        if not self.enabled:
+            return False
+        with self.lock:
+            if self.state == "closed" or (self.state == "open" and
+                                          time.monotonic() - self.opened_at >= self.probe_interval):
+                return False
+        self._count_skip(size)
+        return True
+    
+    def record_success(self):
+        with self.lock:
+            self.counters["rest_successes"] += 1
+            if self.state != "closed":
+                logger.info("REST attachments work again, closing the circuit breaker")
+            self.state = "closed"
+            self.failures = 0
+    
+    def record_failure(self):
+        """Record that the REST endpoint rejected an attachment"""
+        with self.lock:
+            self.counters["rest_failures"] += 1
+            self.failures += 1
+            if self.state == "half_open" or (self.state == "closed" and self.failures >= self.threshold):
+                logger.warning(f"REST attachments failed {self.failures} times in a row, "
+                               f"using the Sync API for the next {self.probe_interval:.0f}s")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+    
+    def record_response(self, status_code):
+        """Record the status of a REST attachment upload; returns whether it succeeded"""
+        if status_code in (200, 201):
+            self.record_success()
+            return True
+        if status_code in RETRYABLE_STATUS_CODES:
+            self.record_inconclusive()
+        else:
+            self.record_failure()
+        return False
+    
+    def record_inconclusive(self):
+        """Record a REST attempt that failed for a transient reason, such as rate limiting or a 5xx"""
+        with self.lock:
+            if self.state == "half_open":
+                # Let the next request probe again
+                self.state = "open"
+                self.opened_at = time.monotonic() - self.probe_interval
+    
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters, enabled=self.enabled, state=self.state, consecutive_failures=self.failures)
+            if self.state == "open":
+                stats["next_probe_in_seconds"] = round(max(0.0, self.opened_at + self.probe_interval - time.monotonic()), 1)
+        return stats
+    
+    def _count_skip(self, size):
+        with self.lock:
+            self.counters["skipped"] += 1
+            self.counters["bytes_saved"] += size
+        ATTACHMENT_BYTES_SAVED.inc(size)
+
+attachment_breaker = AttachmentBreaker()
+
+# Batch endpoint configuration
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", "20"))
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "4"))
+
+# Bounded worker pool for async screenshot jobs and the in-memory job registry
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="screenshot-job")
+jobs = {}
+jobs_lock = threading.Lock()
+
+# Idempotency configuration
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_DERIVE_KEYS = os.getenv("IDEMPOTENCY_DERIVE_KEYS", "true").lower() == "true"
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "600"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "1000"))
+# A retry gets its 409 before the proxy would time it out (ProxyTimeout 60)
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "45"))
+
+class IdempotencyStore:
+    """
+    Bounded in-memory store of screenshot requests by idempotency key
+    A retry of a request that is still running waits for it and gets its response, and a
+    retry of a finished request gets the stored response, so neither calls Claude or
+    creates a Todoist task again. Only successful responses are stored
+    """
+    
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES, ttl=IDEMPOTENCY_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"started": 0, "replayed": 0, "joined": 0, "failed": 0, "evicted": 0}
+    
+    def begin(self, key):
+        """
+        Claim a key for a new request
+        Returns (None, None) when the caller should process the request, or (None, entry) when an
+        earlier request with the key is still running; wait() for it and call begin() again.
+        A finished request's stored response is returned as (response, None)
+        """
+        with self.lock:
+            self._expire()
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = {"event": threading.Event(), "response": None, "created_at": time.time()}
+                self.counters["started"] += 1
+                self._evict()
+                return None, None
+            if entry["response"] is not None:
+                self.counters["replayed"] += 1
+                return entry["response"], None
+            self.counters["joined"] += 1
+            return None, entry
+    
+    @staticmethod
+    def wait(entry, timeout=IDEMPOTENCY_WAIT_TIMEOUT):
+        """Wait for the request holding a key to finish; returns False on timeout"""
+        return entry["event"].wait(timeout)
+    
+    def complete(self, key, data, status, headers=None):
+        """Store the response of a successful request"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return
+            entry["response"] = (data, status, dict(headers or {}))
+            entry["created_at"] = time.time()
+            entry["event"].set()
+    
+    def fail(self, key):
+        """Release a key after a failed request, so a waiting retry processes the request itself"""
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            self.counters["failed"] += 1
+        if entry is not None:
+            entry["event"].set()
+    
+    def stats(self):
+        with self.lock:
+            in_progress = sum(1 for entry in self.entries.values() if entry["response"] is None)
+            return dict(self.counters, entries=len(self.entries), in_progress=in_progress,
+                        max_entries=self.max_entries)
+    
+    def _expire(self):
+        now = time.time()
+        expired = [key for key, entry in self.entries.items()
+                   if entry["response"] is not None and now - entry["created_at"] > self.ttl]
+        for key in expired:
+            del self.entries[key]
+    
+    def _evict(self):
+        # Drop the oldest finished requests first; running ones are only dropped as a last resort
+        while len(self.entries) > self.max_entries:
+            key = next((key for key, entry in self.entries.items() if entry["response"] is not None),
+                       next(iter(self.entries)))
+            self.entries.pop(key)["event"].set()
+            self.counters["evicted"] += 1
+
+idempotency_store = IdempotencyStore()
+
+# Idempotency key of the request being processed in the current context
+current_idempotency_key = contextvars.ContextVar("current_idempotency_key", default=None)
+
+def idempotency_key_for(headers, image_data, additional_instructions, debug_mode, async_mode):
+    """
+    Get the idempotency key of a screenshot request from its Idempotency-Key or X-Request-Id
+    header, or derive it from the image and instructions when IDEMPOTENCY_DERIVE_KEYS is set
+    Returns None when the request should not be deduplicated
+    """
+    if not IDEMPOTENCY_ENABLED:
+        return None
+    # The response differs in debug and async mode, so a stored response is only replayed to
+    # requests in the same mode
+    mode = f"#{'debug' if debug_mode else 'plain'}:{'async' if async_mode else 'sync'}"
+    key = (headers.get("Idempotency-Key") or "").strip()
+    if key:
+        return f"key:{key[:200]}{mode}"
+    key = (headers.get("X-Request-Id") or "").strip()
+    if key:
+        return f"request:{key[:200]}{mode}"
+    if not IDEMPOTENCY_DERIVE_KEYS:
+        return None
+    digest = hashlib.sha256(image_data)
+    digest.update(b"\0" + ResultCache.normalize_instructions(additional_instructions).encode())
+    return f"derived:{digest.hexdigest()}{mode}"
+
+def batch_item_headers(headers, index):
+    """
+    Idempotency headers for one image of a batch, so a retried batch replays each image's own result
+    The batch's Idempotency-Key or X-Request-Id gets the image's position in the batch appended
+    """
+    item_headers = {}
+    for name in ("Idempotency-Key", "X-Request-Id"):
+        value = (headers.get(name) or "").strip()
+        if value:
+            item_headers[name] = f"{value[:190]}/{index}"
+    return item_headers
+
+def is_durable_idempotency_key(key):
+    """
+    Whether Todoist request ids may be derived from an idempotency key
+    Only a client's Idempotency-Key and outbox item keys qualify; Todoist remembers request ids
+    much longer than IDEMPOTENCY_TTL, so a derived key (the same screenshot sent again) or an
+    X-Request-Id would make it drop a deliberate resend as a duplicate
+    """
+    return key is not None and key.startswith(("key:", "outbox:"))
+
+def todoist_request_id(purpose):
+    """
+    X-Request-Id (or Sync API command uuid) for a Todoist write
+    Derived from the request's Idempotency-Key header or outbox item, so Todoist drops the write
+    if a retry gets this far again after the stored response was lost; random otherwise
+    """
+    key = current_idempotency_key.get()
+    if not is_durable_idempotency_key(key):
+        return str(uuid.uuid4())
+    # Leave out the response mode, so Todoist also drops a retry of the same write in another mode
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{key.rsplit('#', 1)[0]}:{purpose}"))
+
+# Todoist outbox configuration
+# off: Todoist errors fail the request, fallback: tasks that could not be created are stored
+# in the outbox and created later, always: every task goes through the outbox, so requests
+# finish as soon as the screenshot is analyzed
+OUTBOX_MODE = os.getenv("OUTBOX_MODE", "fallback").lower()
+OUTBOX_PATH = os.getenv("OUTBOX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "todoist_outbox.db"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "2"))
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "1"))
+OUTBOX_MAX_ITEMS = int(os.getenv("OUTBOX_MAX_ITEMS", "1000"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "20"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "5"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", "300"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1"))
+
+if OUTBOX_MODE not in ("off", "fallback", "always"):
+    logger.warning(f"Unknown OUTBOX_MODE '{OUTBOX_MODE}', disabling the outbox")
+    OUTBOX_MODE = "off"
+
+class OutboxFullError(Exception):
+    """The outbox already holds OUTBOX_MAX_ITEMS tasks"""
+
+class TodoistOutbox:
+    """
+    Durable queue of analyzed tasks waiting to be created in Todoist
+    Tasks are stored with their screenshot in a SQLite database in WAL mode, so they survive
+    restarts and are shared by all worker processes. Drainer threads create them with bounded
+    concurrency and at most OUTBOX_RATE tasks per second, and back off while Todoist fails
+    """
+    
+    def __init__(self, path=OUTBOX_PATH, concurrency=OUTBOX_CONCURRENCY, rate=OUTBOX_RATE,
+                 max_items=OUTBOX_MAX_ITEMS, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.path = path
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_items = max_items
+        self.max_attempts = max_attempts
+        self.pid = os.getpid()
+        self.local = threading.local()
+        self.condition = threading.Condition()
+        self.next_start = 0.0
+        self.paused_until = 0.0
+        self.consecutive_failures = 0
+        self.threads = []
+        self.counters = {"enqueued": 0, "delivered": 0, "retried": 0, "dead": 0, "rejected": 0}
+        self._create_schema()
+    
+    def start(self):
+        """Start the drainer threads"""
+        for index in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"todoist-outbox-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+    
+    def enqueue(self, task_info, image_data, mime_type, task_fields=None):
+        """
+        Store a task, its optional Todoist fields and its screenshot until it has been created in Todoist
+        The request's Idempotency-Key (or a new outbox key) is stored with it, so a delivery that
+        is repeated after a crash sends the same Todoist request ids. Returns the outbox item id
+        """
+        key = current_idempotency_key.get()
+        if not is_durable_idempotency_key(key):
+            key = f"outbox:{uuid.uuid4()}"
+        now = time.time()
+        with stage_timer("outbox_enqueue"), self._transaction() as connection:
+            row = connection.execute("SELECT id FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()
+            if row is not None:
+                return row[0]
+            pending = connection.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+            if pending >= self.max_items:
+                with self.condition:
+                    self.counters["rejected"] += 1
+                raise OutboxFullError(f"Outbox is full ({pending} tasks waiting)")
+            cursor = connection.execute(
+                "INSERT INTO outbox (idempotency_key, task_info, task_fields, mime_type, image, created_at, "
+                "next_attempt_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, task_info, json.dumps(task_fields) if task_fields else None, mime_type,
+                 memoryview(image_data) if image_data else None, now, now))
+            item_id = cursor.lastrowid
+        
+        with self.condition:
+            self.counters["enqueued"] += 1
+            self.condition.notify()
+        logger.info(f"Queued task in the outbox as item {item_id} ({pending + 1} waiting)")
+        return item_id
+    
+    def stats(self):
+        """Report the queue depth, the age of the oldest waiting task and the delivery counters"""
+        connection = self._connect()
+        depth, oldest = connection.execute(
+            "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status = 'pending'").fetchone()
+        dead = connection.execute("SELECT COUNT(*) FROM outbox WHERE status = 'dead'").fetchone()[0]
+        oldest_age = round(time.time() - oldest, 1) if oldest is not None else 0.0
+        OUTBOX_DEPTH.set(depth)
+        OUTBOX_OLDEST_AGE.set(oldest_age)
+        with self.condition:
+            counters = dict(self.counters)
+            paused_for = max(0.0, self.paused_until - time.monotonic())
+        return dict(counters, mode=OUTBOX_MODE, depth=depth, oldest_age_seconds=oldest_age, dead_items=dead,
+                    paused_seconds=round(paused_for, 1), rate_per_second=self.rate, concurrency=self.concurrency)
+    
+    def _connect(self):
+        # SQLite connections cannot be shared between threads, so every thread opens its own
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+    
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so two processes cannot claim the same item
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+    
+    def _create_schema(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                task_info TEXT NOT NULL,
+                task_fields TEXT,
+                mime_type TEXT,
+                image BLOB,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT
+            )
+        """)
+        # Outboxes created before tasks had a priority and labels lack the column
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(outbox)")]
+        if "task_fields" not in columns:
+            connection.execute("ALTER TABLE outbox ADD COLUMN task_fields TEXT")
+        connection.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+    
+    def _run(self):
+        while True:
+            try:
+                self._wait_until_resumed()
+                item = self._claim()
+                if item is None:
+                    self.stats()
+                    with self.condition:
+                        self.condition.wait(OUTBOX_POLL_INTERVAL)
+                    continue
+                self._wait_for_rate_limit()
+                self._deliver(item)
+            except Exception as e:
+                logger.error(f"Outbox drainer crashed: {str(e)}", exc_info=True)
+                time.sleep(OUTBOX_POLL_INTERVAL)
+    
+    def _wait_until_resumed(self):
+        # After a failure every drainer in this process pauses, instead of hammering Todoist
+        while True:
+            with self.condition:
+                delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+    
+    def _wait_for_rate_limit(self):
+        # Space out delivery starts, so a backlog is drained at a steady rate instead of in a burst
+        with self.condition:
+            start = max(time.monotonic(), self.next_start)
+            self.next_start = start + 1 / self.rate
+        delay = start - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def _claim(self):
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT id, idempotency_key, task_info, task_fields, mime_type, image, attempts, created_at FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 1",
+                (now,)).fetchone()
+            if row is None:
+                return None
+            # Lease the item; if this process dies during the delivery it becomes due again
+            connection.execute("UPDATE outbox SET next_attempt_at = ?, attempts = attempts + 1 WHERE id = ?",
+                               (now + OUTBOX_LEASE, row[0]))
+        return row
+    
+    def _deliver(self, item):
+        item_id, key, task_info, task_fields, mime_type, image_data, attempts, created_at = item
+        attempts += 1
+        # Todoist request ids are derived from the stored key, so Todoist drops repeated deliveries
+        current_idempotency_key.set(key)
+        log_buffer = start_request_logging()
+        logger.info(f"Delivering outbox item {item_id} (attempt {attempts}): {task_info}")
+        try:
+            task = create_todoist_task(task_info, image_data, mime_type,
+                                       task_fields=json.loads(task_fields) if task_fields else None)
+        except Exception as e:
+            finish_request_logging(log_buffer, failed=True)
+            self._retry(item_id, attempts, str(e))
+            return
+        finish_request_logging(log_buffer, failed=False)
+        
+        self._connect().execute("DELETE FROM outbox WHERE id = ?", (item_id,))
+        STAGE_LATENCY.labels(stage="outbox_delivery_delay").observe(time.time() - created_at)
+        OUTBOX_DELIVERIES.labels(outcome="delivered").inc()
+        with self.condition:
+            self.counters["delivered"] += 1
+            self.consecutive_failures = 0
+        logger.info(f"Outbox item {item_id} delivered as task {task.get('id')} "
+                    f"after {time.time() - created_at:.1f}s")
+    
+    def _retry(self, item_id, attempts, error):
+        connection = self._connect()
+        if attempts >= self.max_attempts:
+            # Keep the item for inspection instead of retrying it forever
+            connection.execute("UPDATE outbox SET status = 'dead', last_error = ? WHERE id = ?", (error, item_id))
+            OUTBOX_DELIVERIES.labels(outcome="dead").inc()
+            with self.condition:
+                self.counters["dead"] += 1
+            logger.error(f"Giving up on outbox item {item_id} after {attempts} attempts: {error}")
+            return
+        
+        with self.condition:
+            self.consecutive_failures += 1
+            delay = self._backoff(self.consecutive_failures)
+            self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            self.counters["retried"] += 1
+        connection.execute("UPDATE outbox SET next_attempt_at = ?, last_error = ? WHERE id = ?",
+                           (time.time() + self._backoff(attempts), error, item_id))
+        OUTBOX_DELIVERIES.labels(outcome="retried").inc()
+        logger.warning(f"Outbox item {item_id} failed (attempt {attempts}), pausing deliveries for {delay:.1f}s: {error}")
+    
+    @staticmethod
+    def _backoff(attempt):
+        # Jittered exponential backoff, so items that failed together are not retried together
+        return random.uniform(0.5, 1.0) * min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** (attempt - 1)))
+
+_outbox = None
+_outbox_lock = threading.Lock()
+
+def get_outbox():
+    """Return the shared outbox, creating it and starting its drainers on first use in each process"""
+    global _outbox
+    with _outbox_lock:
+        # The drainer threads and SQLite connections do not survive a fork
+        if _outbox is None or _outbox.pid != os.getpid():
+            _outbox = TodoistOutbox()
+            _outbox.start()
+        return _outbox
+
+def queue_todoist_task(task_info, image_data, mime_type, error=None, task_fields=None):
+    """
+    Store an analyzed task in the outbox, so it is created in Todoist later instead of failing the request
+    error is the exception of the failed direct attempt in fallback mode; it is raised again
+    if the outbox cannot take the task
+    Returns a stand-in for the Todoist response with the outbox item id
+    """
+    try:
+        item_id = get_outbox().enqueue(task_info, image_data, mime_type or "image/jpeg", task_fields)
+    except Exception as e:
+        logger.error(f"Could not add task to the outbox: {str(e)}", exc_info=True)
+        if error is not None:
+            raise error
+        raise Exception(f"Failed to queue Todoist task: {str(e)}")
+    return {"outbox_id": item_id, "content": task_info}
+
+class BufferReader(io.RawIOBase):
+    """Seekable read-only file object over a bytes-like buffer that does not copy it"""
+    
+    def __init__(self, buffer):
+        self.view = memoryview(buffer)
+        self.position = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def readinto(self, target):
+        chunk = self.view[self.position:self.position + len(target)]
+        target[:len(chunk)] = chunk
+        self.position += len(chunk)
+        return len(chunk)
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(0, offset)
+        return self.position
+    
+    def tell(self):
+        return self.position
+
+class MultipartBody:
+    """
+    Streamed multipart/form-data body with a single file field
+    The file is read from the shared upload buffer in chunks while the body is sent,
+    instead of being copied into a complete body in memory first
+    """
+    
+    chunk_size = 64 * 1024
+    
+    def __init__(self, field_name, filename, buffer, mime_type):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        head = (f'--{boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+                f'Content-Type: {mime_type}\r\n\r\n').encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        self.segments = [memoryview(head), memoryview(buffer), memoryview(tail)]
+        self.length = sum(len(segment) for segment in self.segments)
+        self.position = 0
+    
+    def __len__(self):
+        return self.length
+    
+    def __iter__(self):
+        while True:
+            chunk = self.read(self.chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.length
+        parts = []
+        offset = 0
+        for segment in self.segments:
+            start = self.position - offset
+            if 0 <= start < len(segment) and size > 0:
+                part = segment[start:start + size]
+                parts.append(bytes(part))
+                self.position += len(part)
+                size -= len(part)
+            offset += len(segment)
+        return b"".join(parts)
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Only rewinding is needed, so the client can resend the body on a retry
+        self.position = offset if whence == io.SEEK_SET else self.position + offset
+        return self.position
+    
+    def tell(self):
+        return self.position
+
+def ingest_upload(file_storage):
+    """
+    Get an uploaded file as one buffer that is shared by the Claude and Todoist stages
+    Uploads that were spooled to disk are memory-mapped instead of read into the heap
+    Returns the buffer and whether it is memory-mapped
+    """
+    stream = file_storage.stream
+    if not isinstance(stream, tempfile.SpooledTemporaryFile):
+        try:
+            fileno = stream.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            fileno = None
+        if fileno is not None:
+            stream.flush()
+            size = os.fstat(fileno).st_size
+            if size > 0:
+                return mmap.mmap(fileno, size, access=mmap.ACCESS_READ), True
+    return file_storage.read(), False
+
+def memory_usage():
+    """Return the current and peak resident set size of this process in KB (None if unknown)"""
+    current_kb = peak_kb = None
+    try:
+        with open("/proc/self/statm") as f:
+            current_kb = int(f.read().split()[1]) * mmap.PAGESIZE // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # ru_maxrss is in KB on Linux but in bytes on macOS
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak_kb //= 1024
+    return current_kb, peak_kb
+
+# Result cache configuration
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")
+# Near-duplicate matching is opt-in: screenshots with the same layout but different text can
+# look alike to a perceptual hash, and would then get another screenshot's task
+RESULT_CACHE_MAX_DISTANCE = int(os.getenv("RESULT_CACHE_MAX_DISTANCE", "0"))
+
+class ResultCache:
+    """
+    Bounded LRU/TTL cache of Claude results for screenshots we have already analyzed
+    Entries are keyed by the SHA-256 of the image bytes and the normalized additional
+    instructions, and can optionally be persisted to disk. With max_distance set, a miss
+    falls back to a screenshot of the same dimensions whose perceptual hash differs in at
+    most that many of its 4096 bits
+    """
+    
+    def __init__(self, max_entries, ttl, path=None, max_distance=0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_distance = max_distance
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.perceptual_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if self.enabled and self.path:
+            self._load()
+    
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+    
+    @staticmethod
+    def normalize_instructions(additional_instructions):
+        """Collapse case and whitespace so equivalent instructions share a cache entry"""
+        normalized = " ".join((additional_instructions or "").lower().split())
+        return "" if normalized == "no additional instructions" else normalized
+    
+    @staticmethod
+    def perceptual_hash(image_data):
+        """
+        Compute a 4096-bit difference hash of the image
+        Returns the hash and the image dimensions, or (None, None) if it cannot be decoded
+        """
+        if Image is None:
+            return None, None
+        try:
+            with Image.open(BufferReader(image_data)) as img:
+                dimensions = "x".join(map(str, img.size))
+                pixels = list(img.convert("L").resize((65, 64)).getdata())
+        except Exception as e:
+            logger.debug(f"Could not compute perceptual hash: {str(e)}")
+            return None, None
+        bits = 0
+        for row in range(64):
+            for col in range(64):
+                bits = (bits << 1) | (pixels[row * 65 + col] > pixels[row * 65 + col + 1])
+        return f"{bits:01024x}", dimensions
+    
+    def fingerprint(self, image_data, additional_instructions):
+        """Build the lookup fingerprint for an image and its instructions"""
+        # Decoding the image for the perceptual hash is only worth it if near-duplicates can match
+        phash, dimensions = self.perceptual_hash(image_data) if self.max_distance > 0 else (None, None)
+        return {
+            "sha256": hashlib.sha256(image_data).hexdigest(),
+            "phash": phash,
+            "dimensions": dimensions,
+            "instructions": self.normalize_instructions(additional_instructions)
+        }
+    
+    def get(self, fingerprint):
+        """
+        Return the cached entry for the fingerprint and how it matched ('exact' or 'perceptual')
+        Returns (None, None) on a miss
+        """
+        if not self.enabled:
+            return None, None
+        now = time.time()
+        key = f"{fingerprint['sha256']}:{fingerprint['instructions']}"
+        with self.lock:
+            self._expire(now)
+            entry = self.entries.get(key)
+            match = "exact" if entry else None
+            
+            # Fall back to the closest near-duplicate screenshot with the same dimensions and instructions
+            if not entry and fingerprint["phash"] and self.max_distance > 0:
+                target = int(fingerprint["phash"], 16)
+                best_distance = self.max_distance + 1
+                for candidate_key, candidate in self.entries.items():
+                    if (candidate["instructions"] != fingerprint["instructions"] or not candidate.get("phash")
+                            or candidate.get("dimensions") != fingerprint["dimensions"]):
+                        continue
+                    distance = bin(target ^ int(candidate["phash"], 16)).count("1")
+                    if distance < best_distance:
+                        key, entry, best_distance = candidate_key, candidate, distance
+                match = "perceptual" if entry else None
+            
+            if not entry:
+                self.misses += 1
+                return None, None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if match == "perceptual":
+                self.perceptual_hits += 1
+            return entry, match
+    
+    def put(self, fingerprint, task_info, anthropic_response):
+        """Store the Claude result for the fingerprint, evicting the least recently used entries"""
+        if not self.enabled:
+            return
+        key = f"{fingerprint['sha256']}:{fingerprint['instructions']}"
+        with self.lock:
+            self.entries[key] = dict(fingerprint, task_info=task_info,
+                                     anthropic_response=anthropic_response, created_at=time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+            if self.path:
+                self._save()
+    
+    def stats(self):
+        """Report hit/miss counters for diagnostics"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "perceptual_hits": self.perceptual_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "persistent": bool(self.path)
+            }
+    
+    def _expire(self, now):
+        # Entries are kept in LRU order, not insertion order, so check them all
+        expired = [key for key, entry in self.entries.items() if now - entry["created_at"] > self.ttl]
+        for key in expired:
+            del self.entries[key]
+    
+    def _load(self):
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path) as f:
+                for entry in json.load(f):
+                    self.entries[f"{entry['sha256']}:{entry['instructions']}"] = entry
+            self._expire(time.time())
+            logger.info(f"Loaded {len(self.entries)} cached results from {self.path}")
+        except Exception as e:
+            logger.error(f"Error loading result cache from {self.path}: {str(e)}")
+    
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a truncated cache behind
+        try:
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(list(self.entries.values()), f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Error saving result cache to {self.path}: {str(e)}")
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_PATH, RESULT_CACHE_MAX_DISTANCE)
+
+# Image normalization configuration
+# Claude downscales anything beyond ~1568px on the long edge or ~1.15 megapixels,
+# so sending more than that only costs upload time and tokens
+IMAGE_NORMALIZE = os.getenv("IMAGE_NORMALIZE", "true").lower() == "true"
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1568"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", "1150000"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_CROP_BORDERS = os.getenv("IMAGE_CROP_BORDERS", "true").lower() == "true"
+IMAGE_BORDER_TOLERANCE = int(os.getenv("IMAGE_BORDER_TOLERANCE", "8"))
+
+IMAGE_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+# Running totals so the upload savings can be measured over time
+image_preprocessing_totals = {"images": 0, "normalized": 0, "bytes_before": 0, "bytes_after": 0, "encode_ms": 0.0}
+image_preprocessing_lock = threading.Lock()
+
+# Upload profile configuration
+# The upload pages resize screenshots to the profile published at /upload-profile before
+# uploading them, so a multi-MB original does not have to cross a slow connection first
+CLIENT_RESIZE = os.getenv("CLIENT_RESIZE", "true").lower() == "true"
+
+client_upload_totals = {"uploads": 0, "resized": 0, "original_bytes": 0, "uploaded_bytes": 0}
+client_upload_lock = threading.Lock()
+
+def upload_profile():
+    """The largest size, format and quality of screenshot the server needs"""
+    return {
+        # Without normalization Claude gets the upload as is, so it must not be resized
+        "resize": CLIENT_RESIZE and IMAGE_NORMALIZE,
+        "max_edge": IMAGE_MAX_EDGE,
+        "max_pixels": IMAGE_MAX_PIXELS,
+        "format": IMAGE_MIME_TYPES.get(IMAGE_FORMAT, "image/jpeg"),
+        "quality": IMAGE_QUALITY / 100
+    }
+
+def record_client_upload(original_size, uploaded_size, original_dimensions=None):
+    """
+    Log the size of the original image next to the uploaded one, from the original_size form field
+    Uploads without the field (such as from the iOS Shortcut) are not counted
+    """
+    try:
+        original_size = int(original_size)
+    except (TypeError, ValueError):
+        return
+    if original_size <= 0:
+        return
+    
+    resized = uploaded_size < original_size
+    with client_upload_lock:
+        client_upload_totals["uploads"] += 1
+        client_upload_totals["resized"] += int(resized)
+        client_upload_totals["original_bytes"] += original_size
+        client_upload_totals["uploaded_bytes"] += uploaded_size
+    CLIENT_UPLOAD_BYTES.labels(kind="original").inc(original_size)
+    CLIENT_UPLOAD_BYTES.labels(kind="uploaded").inc(uploaded_size)
+    
+    if resized:
+        logger.info(f"Client resized the upload from {original_dimensions or 'unknown dimensions'}: "
+                    f"{original_size} -> {uploaded_size} bytes ({1 - uploaded_size / original_size:.0%} smaller)")
+    else:
+        logger.info(f"Client uploaded the original image ({original_size} bytes)")
+
+def _find_content_box(img):
+    """
+    Find the bounding box of the image without uniform borders (status bars, letterboxing)
+    Each edge is compared against the colour of its own corner, on a reduced copy for speed
+    Returns None if there is nothing worth cropping
+    """
+    scale = max(1, max(img.size) // 512)
+    small = img.reduce(scale) if scale > 1 else img
+    width, height = small.size
+    corners = {
+        "top": small.getpixel((0, 0)),
+        "left": small.getpixel((0, 0)),
+        "bottom": small.getpixel((0, height - 1)),
+        "right": small.getpixel((width - 1, 0))
+    }
+    
+    box = {}
+    for edge, colour in corners.items():
+        diff = ImageChops.difference(small, Image.new(small.mode, small.size, colour)).convert("L")
+        bbox = diff.point(lambda value: 255 if value > IMAGE_BORDER_TOLERANCE else 0).getbbox()
+        if not bbox:
+            return None
+        box[edge] = bbox[("left", "top", "right", "bottom").index(edge)]
+    
+    # Map back to full resolution, rounding outwards so no content is lost
+    left = max(0, box["left"] * scale)
+    top = max(0, box["top"] * scale)
+    right = min(img.size[0], box["right"] * scale + scale)
+    bottom = min(img.size[1], box["bottom"] * scale + scale)
+    
+    # Skip tiny crops and crops that would throw away most of the image
+    cropped_area = (right - left) * (bottom - top)
+    if right <= left or bottom <= top or cropped_area < 0.25 * img.size[0] * img.size[1]:
+        return None
+    if (left, top, right, bottom) == (0, 0) + img.size:
+        return None
+    return (left, top, right, bottom)
+
+def _record_preprocessing(stats):
+    """Add a normalized image's statistics to the running totals"""
+    with image_preprocessing_lock:
+        image_preprocessing_totals["images"] += 1
+        image_preprocessing_totals["normalized"] += int(stats["applied"])
+        image_preprocessing_totals["bytes_before"] += stats["bytes_before"]
+        image_preprocessing_totals["bytes_after"] += stats["bytes_after"]
+        image_preprocessing_totals["encode_ms"] = round(image_preprocessing_totals["encode_ms"] + stats["encode_ms"], 1)
+
+def normalize_image(image_data, mime_type):
+    """
+    Prepare a screenshot for Claude: fix EXIF rotation, crop uniform borders,
+    downscale to the model's effective maximum resolution and re-encode compactly
+    Returns the image data and MIME type to send, plus statistics about the conversion
+    """
+    stats = {"applied": False, "bytes_before": len(image_data), "bytes_after": len(image_data)}
+    if not IMAGE_NORMALIZE or Image is None:
+        stats["reason"] = "disabled" if not IMAGE_NORMALIZE else "Pillow is not installed"
+        return image_data, mime_type, stats
+    
+    start_time = time.perf_counter()
+    try:
+        with Image.open(BufferReader(image_data)) as original:
+            stats["original_size"] = list(original.size)
+            img = ImageOps.exif_transpose(original)
+            
+            # Flatten transparency, JPEG has no alpha channel
+            if img.mode in ("RGBA", "LA", "P"):
+                img = img.convert("RGBA")
+                background = Image.new("RGB", img.size, (255, 255, 255))
+                background.paste(img, mask=img.getchannel("A"))
+                img = background
+            elif img.mode != "RGB":
+                img = img.convert("RGB")
+            
+            if IMAGE_CROP_BORDERS:
+                box = _find_content_box(img)
+                if box:
+                    img = img.crop(box)
+                    stats["crop_box"] = list(box)
+            
+            width, height = img.size
+            scale = min(1.0, IMAGE_MAX_EDGE / max(width, height), (IMAGE_MAX_PIXELS / (width * height)) ** 0.5)
+            if scale < 1.0:
+                img = img.resize((max(1, int(width * scale)), max(1, int(height * scale))), Image.LANCZOS)
+            stats["final_size"] = list(img.size)
+            
+            output = io.BytesIO()
+            if IMAGE_FORMAT == "PNG":
+                img.save(output, "PNG", optimize=True)
+            else:
+                img.save(output, IMAGE_FORMAT, quality=IMAGE_QUALITY, optimize=True)
+            normalized_data = output.getvalue()
+    except Exception as e:
+        logger.warning(f"Image normalization failed, sending original image: {str(e)}")
+        stats["reason"] = f"error: {str(e)}"
+        return image_data, mime_type, stats
+    finally:
+        stats["encode_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+    
+    # Keep the original if re-encoding did not make it any smaller and nothing was resized or cropped
+    unchanged = stats["final_size"] == stats["original_size"] and "crop_box" not in stats
+    if unchanged and len(normalized_data) >= len(image_data):
+        stats["reason"] = "original is already compact"
+        _record_preprocessing(stats)
+        return image_data, mime_type, stats
+    
+    stats["applied"] = True
+    stats["bytes_after"] = len(normalized_data)
+    stats["format"] = IMAGE_FORMAT
+    _record_preprocessing(stats)
+    
+    logger.info(f"Normalized image {stats['original_size']} -> {stats['final_size']}, "
+                f"{stats['bytes_before']} -> {stats['bytes_after']} bytes in {stats['encode_ms']} ms")
+    return normalized_data, IMAGE_MIME_TYPES.get(IMAGE_FORMAT, mime_type), stats
+
+# Static page cache configuration
+STATIC_CACHE = os.getenv("STATIC_CACHE", "true").lower() == "true"
+# The pages have no version in their URL, so by default browsers revalidate them with the ETag every time
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", "0"))
+STATIC_WATCH_INTERVAL = float(os.getenv("STATIC_WATCH_INTERVAL", "2"))
+# Pages and scripts that create_app() loads and compresses before the first request
+STATIC_PAGES = ("index.html", "tester.html", "upload.js")
+
+class StaticAsset:
+    """A static file held in memory with its precompressed variants"""
+    
+    def __init__(self, path, data, mtime_ns):
+        self.path = path
+        self.size = len(data)
+        self.mtime_ns = mtime_ns
+        self.mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        # Every encoding is a different representation, so each gets its own strong ETag
+        self.variants = {"identity": (data, digest)}
+        compressed = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(data, quality=11)
+        for encoding, body in compressed.items():
+            if len(body) < self.size:
+                self.variants[encoding] = (body, f"{digest}-{encoding}")
+        self.etags = [etag for _, etag in self.variants.values()]
+    
+    def sizes(self):
+        return {encoding: len(body) for encoding, (body, _) in self.variants.items()}
+
+class StaticAssetCache:
+    """
+    In-memory copies of the static pages, precompressed with gzip (and brotli if installed)
+    Pages are served with a strong ETag and Cache-Control, and a request whose If-None-Match
+    matches gets a 304. A background thread checks the files every STATIC_WATCH_INTERVAL
+    seconds and reloads the ones that changed, so serving a page never touches the disk
+    """
+    
+    def __init__(self):
+        self.assets = {}
+        self.lock = threading.Lock()
+        self.watcher_pid = None
+        self.counters = {"served": 0, "not_modified": 0, "loads": 0, "reloads": 0, "bytes_saved": 0}
+    
+    def load(self, folder, filename):
+        """Read and compress a file, replacing its cached copy; returns None if it does not exist"""
+        path = safe_join(folder, filename)
+        if path is None:
+            return None
+        return self._load_path(path)
+    
+    def preload(self, folder, filenames):
+        for filename in filenames:
+            asset = self.load(folder, filename)
+            if asset is None:
+                logger.warning(f"Static page {filename} not found in {folder}")
+            else:
+                logger.info(f"Cached static page {filename}: {asset.sizes()} bytes")
+    
+    def serve(self, folder, filename):
+        """Return the response for a static file, loading it on first use; raises NotFound if it does not exist"""
+        self.start_watcher()
+        path = safe_join(folder, filename)
+        asset = self.assets.get(path) if path is not None else None
+        if asset is None:
+            asset = self.load(folder, filename)
+            if asset is None:
+                raise NotFound()
+        
+        encoding = request.accept_encodings.best_match([e for e in ("br", "gzip") if e in asset.variants]) or "identity"
+        body, etag = asset.variants[encoding]
+        
+        if any(request.if_none_match.contains_weak(tag) for tag in asset.etags):
+            response = Response(status=304)
+            status = "304"
+            with self.lock:
+                self.counters["not_modified"] += 1
+        else:
+            response = Response(body, mimetype=asset.mimetype)
+            status = "200"
+            if encoding != "identity":
+                response.headers["Content-Encoding"] = encoding
+            with self.lock:
+                self.counters["served"] += 1
+                self.counters["bytes_saved"] += asset.size - len(body)
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = f"public, max-age={STATIC_MAX_AGE}" if STATIC_MAX_AGE > 0 else "no-cache"
+        response.headers["Vary"] = "Accept-Encoding"
+        STATIC_RESPONSES.labels(encoding=encoding, status=status).inc()
+        return response
+    
+    def start_watcher(self):
+        """Start the thread that reloads changed files, once in each process"""
+        # Threads do not survive a fork, so a forked worker starts its own
+        if STATIC_WATCH_INTERVAL <= 0 or self.watcher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.watcher_pid == os.getpid():
+                return
+            self.watcher_pid = os.getpid()
+        threading.Thread(target=self._watch, name="static-watcher", daemon=True).start()
+    
+    def stats(self):
+        with self.lock:
+            assets = {os.path.basename(path): asset.sizes() for path, asset in self.assets.items()}
+            return dict(self.counters, enabled=STATIC_CACHE, brotli=brotli is not None, assets=assets)
+    
+    def _load_path(self, path):
+        try:
+            with open(path, "rb") as f:
+                mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+                data = f.read()
+        except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+            with self.lock:
+                self.assets.pop(path, None)
+            return None
+        asset = StaticAsset(path, data, mtime_ns)
+        with self.lock:
+            self.assets[path] = asset
+            self.counters["loads"] += 1
+        return asset
+    
+    def _watch(self):
+        while True:
+            time.sleep(STATIC_WATCH_INTERVAL)
+            with self.lock:
+                assets = list(self.assets.values())
+            for asset in assets:
+                try:
+                    stat = os.stat(asset.path)
+                    if stat.st_mtime_ns == asset.mtime_ns and stat.st_size == asset.size:
+                        continue
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Could not check static file {asset.path}: {str(e)}")
+                    continue
+                try:
+                    reloaded = self._load_path(asset.path)
+                except Exception as e:
+                    logger.error(f"Error reloading static file {asset.path}: {str(e)}")
+                    continue
+                with self.lock:
+                    self.counters["reloads"] += 1
+                if reloaded is None:
+                    logger.info(f"Static file {asset.path} was removed, dropped it from the cache")
+                else:
+                    logger.info(f"Static file {asset.path} changed, reloaded it ({reloaded.sizes()} bytes)")
+
+static_assets = StaticAssetCache()
+
+def serve_static_page(filename):
+    """Serve a page from the static folder, from memory unless STATIC_CACHE is off"""
+    if STATIC_CACHE:
+        return static_assets.serve(current_app.static_folder, filename)
+    return send_from_directory(current_app.static_folder, filename)
+
+@routes.route('/')
 def index():
     """Serve the index.html file"""
-    return send_from_directory(app.static_folder, 'index.html')
+    return serve_static_page('index.html')
 
-@app.route('/tester')
+@routes.route('/tester')
 def tester():
     """Serve the tester.html file with proper error handling"""
     try:
-        return send_from_directory(app.static_folder, 'tester.html')
+        return serve_static_page('tester.html')
     except Exception as e:
         logger.error(f"Error serving tester page: {str(e)}")
         error_id = os.urandom(8).hex()
@@ -158,33 +2295,142 @@ def tester():
             </html>
         """, error_message=str(e), error_id=error_id), 500
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Enhanced health check endpoint"""
-    try:
-        # Check if we can create a test message with Anthropic
-        client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=10,
+@routes.route('/upload.js')
+def upload_script():
+    """Serve the resizing script shared by the upload page and the tester"""
+    return serve_static_page('upload.js')
+
+@routes.route('/upload-profile', methods=['GET'])
+def get_upload_profile():
+    """Publish the size, format and quality the upload pages should resize screenshots to"""
+    response = jsonify(upload_profile())
+    response.headers["Cache-Control"] = "public, max-age=300"
+    return response
+
+# Health probe configuration
+HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "60"))
+HEALTH_PROBE_MODEL = os.getenv("HEALTH_PROBE_MODEL", "claude-3-haiku-20240307")
+
+class HealthProbe:
+    """
+    Background probe of the Anthropic and Todoist APIs
+    Readiness checks serve the last result instead of calling the APIs on every request
+    """
+    
+    def __init__(self, interval):
+        self.interval = interval
+        self.result = None
+        self.lock = threading.Lock()
+        self.thread = None
+        self.started_at = time.time()
+    
+    def latest(self):
+        """Return the latest probe result, running the first probe synchronously if there is none yet"""
+        self._ensure_started()
+        with self.lock:
+            result = self.result
+        if result is None:
+            result = self.probe()
+        return result
+    
+    def probe(self):
+        """Check both upstream APIs and store the result"""
+        checks = {
+            "anthropic": self._check(self._probe_anthropic),
+            "todoist": self._check(self._probe_todoist)
+        }
+        result = {
+            "status": "healthy" if all(check["ok"] for check in checks.values()) else "unhealthy",
+            "checks": checks,
+            "checked_at": time.time()
+        }
+        with self.lock:
+            self.result = result
+        if result["status"] != "healthy":
+            logger.error(f"Health probe failed: {checks}")
+        return result
+    
+    def _ensure_started(self):
+        # Start the probe thread lazily, so it also runs in forked worker processes
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="health-probe", daemon=True)
+                self.thread.start()
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.probe()
+            except Exception as e:
+                logger.error(f"Health probe crashed: {str(e)}", exc_info=True)
+    
+    @staticmethod
+    def _check(probe_function):
+        start_time = time.perf_counter()
+        try:
+            probe_function()
+            check = {"ok": True}
+        except Exception as e:
+            check = {"ok": False, "error": str(e)}
+        check["latency_ms"] = round((time.perf_counter() - start_time) * 1000, 1)
+        return check
+    
+    @staticmethod
+    def _probe_anthropic():
+        # The smallest possible request with the cheapest model, once per interval
+        get_anthropic_client().messages.create(
+            model=HEALTH_PROBE_MODEL,
+            max_tokens=1,
             messages=[{
                 "role": "user",
                 "content": "test"
             }]
         )
-        return jsonify({
-            "status": "healthy",
-            "anthropic": "connected",
-            "version": anthropic.__version__
-        }), 200
-    except Exception as e:
-        logger.error(f"Health check failed: {str(e)}")
-        return jsonify({
-            "status": "unhealthy",
-            "error": str(e),
-            "version": anthropic.__version__
-        }), 500
-
-@app.route('/process-screenshot', methods=['POST'])
+    
+    @staticmethod
+    def _probe_todoist():
+        response = get_todoist_client().get("/rest/v2/projects", max_retries=0)
+        if response.status_code != 200:
+            raise Exception(f"Todoist API returned {response.status_code}")
+
+health_probe = HealthProbe(HEALTH_PROBE_INTERVAL)
+
+@routes.route('/health/live', methods=['GET'])
+def liveness_check():
+    """Liveness endpoint that answers locally without calling any external API"""
+    return jsonify({
+        "status": "alive",
+        "pid": os.getpid(),
+        "uptime_seconds": round(time.time() - health_probe.started_at, 1),
+        "version": anthropic.__version__
+    }), 200
+
+@routes.route('/health', methods=['GET'])
+@routes.route('/health/ready', methods=['GET'])
+def health_check():
+    """
+    Readiness endpoint that serves the cached result of the background API probe
+    The result is considered stale (and unhealthy) if the probe has not run for three intervals
+    """
+    result = health_probe.latest()
+    age = time.time() - result["checked_at"]
+    stale = age > 3 * HEALTH_PROBE_INTERVAL
+    healthy = result["status"] == "healthy" and not stale
+    
+    response_data = {
+        "status": "healthy" if healthy else "unhealthy",
+        "anthropic": "connected" if result["checks"]["anthropic"]["ok"] else "unavailable",
+        "todoist": "connected" if result["checks"]["todoist"]["ok"] else "unavailable",
+        "checks": result["checks"],
+        "age_seconds": round(age, 1),
+        "stale": stale,
+        "probe_interval_seconds": HEALTH_PROBE_INTERVAL,
+        "version": anthropic.__version__
+    }
+    return jsonify(response_data), 200 if healthy else 503
+
+@routes.route('/process-screenshot', methods=['POST'])
 def process_screenshot():
     """
     Process a screenshot image:
@@ -197,11 +2443,22 @@ def process_screenshot():
     Query parameters:
     - debug: If set to 'true', returns detailed debug information
     - additional_instructions: Optional additional instructions to include in the prompt
+    - async: If set to 'true', returns 202 with a job id and processes the image in the background
     """
     try:
+        # Receive the multipart body before anything reads the form, so upload_read covers the whole upload
+        # Get the image data as one buffer shared by all stages (memory-mapped for large uploads)
+        with stage_timer("upload_read"):
+            image_file = request.files.get('image')
+            if image_file is not None:
+                image_data, memory_mapped = ingest_upload(image_file)
+        
         # Check if in debug mode
         debug_mode = request.args.get('debug', 'false').lower() == 'true' or request.form.get('debug', 'false').lower() == 'true'
         
+        # Check if the caller wants to poll /jobs/<id> instead of waiting for the result
+        async_mode = request.args.get('async', 'false').lower() == 'true' or request.form.get('async', 'false').lower() == 'true'
+        
         # Get additional instructions if provided
         additional_instructions = request.args.get('additional_instructions', '') or request.form.get('additional_instructions', '')
         additional_instructions = additional_instructions.strip()
@@ -212,11 +2469,10 @@ def process_screenshot():
             additional_instructions = "no additional instructions"
         
         # Check if the request contains an image
-        if 'image' not in request.files:
+        if image_file is None:
             logger.error("No image file in request")
             return jsonify({"error": "No image file provided"}), 400
         
-        image_file = request.files['image']
         logger.info(f"Received image: {image_file.filename}, type: {image_file.content_type}, size: {request.content_length} bytes")
         
         # Get additional file metadata if provided
@@ -226,102 +2482,567 @@ def process_screenshot():
         
         logger.debug(f"File metadata: name={file_name}, type={file_type}, size={file_size or 'unknown'}")
         
-        # Read the image data as bytes
-        image_data = image_file.read()
-        logger.info(f"Read {len(image_data)} bytes of image data")
-        
-        # Store the original image data for file attachment
-        original_image_data = image_data
-        
-        # Convert image to base64 for Claude
-        base64_image = base64.b64encode(image_data).decode('utf-8')
+        logger.info(f"Read {len(image_data)} bytes of image data{' (memory-mapped)' if memory_mapped else ''}")
+        record_client_upload(request.form.get('original_size'), len(image_data), request.form.get('original_dimensions'))
         
         # Get the image MIME type
         mime_type = image_file.content_type or "image/jpeg"  # Default to JPEG if not specified
         
-        # Call Claude Vision API
-        logger.info("Calling Claude Vision API")
-        task_info, anthropic_response = analyze_image_with_claude(base64_image, mime_type, additional_instructions)
-        
-        # Create task in Todoist with the original image data
-        logger.info(f"Creating Todoist task: {task_info}")
-        logger.debug(f"Image data type: {type(original_image_data)}, length: {len(original_image_data)} bytes")
-        todoist_response = create_todoist_task(task_info, original_image_data, mime_type)
-        
-        # Check if file attachment was successful
-        file_attached = "file_attachment" in todoist_response
-        logger.info(f"File attachment status: {'SUCCESS' if file_attached else 'FAILED'}")
-        
-        # Extract the title from the task (remove any time estimate at the beginning if present)
-        task_title = task_info
-        if ": " in task_info and len(task_info) >= 5 and task_info[0].isdigit() and task_info[1].isdigit():
-            task_title = task_info[4:].strip()
-        
-        # Prepare response data
-        if debug_mode:
-            # Return detailed response for debugging
-            response_data = {
-                "status": "success",
-                "task": task_info,
-                "title": task_title,
-                "anthropic_response": anthropic_response,
-                "todoist_response": todoist_response,
-                "task_created": True,
-                "file_attached": file_attached,
-                "diagnostics": {
-                    "image_size": len(original_image_data),
-                    "mime_type": mime_type,
-                    "file_name": file_name,
-                    "has_todoist_key": bool(TODOIST_API_KEY),
-                    "todoist_key_length": len(TODOIST_API_KEY) if TODOIST_API_KEY else 0
-                }
-            }
-            
-            # Add file attachment info if available
-            if file_attached:
-                response_data["file_attachment"] = todoist_response.get("file_attachment", {})
-                response_data["attachment_details"] = {
-                    "comment_id": todoist_response["file_attachment"].get("id"),
-                    "task_id": todoist_response["id"]
-                }
-        else:
-            # Return simplified response for regular use
-            response_data = {
-                "status": "success",
-                "title": task_title,
-                "task_created": True,
-                "file_attached": file_attached
-            }
-            
+        # A retry of a request that is running or finished gets that request's response
+        idempotency_key = idempotency_key_for(request.headers, image_data, additional_instructions, debug_mode, async_mode)
+        if idempotency_key:
+            stored = claim_idempotency_key(idempotency_key)
+            if stored is not None:
+                data, status, headers = stored
+                response = jsonify(data)
+                response.headers.update(headers)
+                response.headers["Idempotent-Replayed"] = "true"
+                return response, status
+            current_idempotency_key.set(idempotency_key)
+        
+        # In async mode, hand the Claude and Todoist stages to the worker pool and return right away
+        if async_mode:
+            response, status = submit_screenshot_job(image_data, mime_type, file_name, additional_instructions, debug_mode)
+            if idempotency_key and status == 202:
+                idempotency_store.complete(idempotency_key, response.get_json(), status, {"Location": response.headers["Location"]})
+            elif idempotency_key:
+                idempotency_store.fail(idempotency_key)
+            return response, status
+        
+        response_data = run_screenshot_pipeline(image_data, mime_type, file_name, additional_instructions, debug_mode)
+        if idempotency_key:
+            idempotency_store.complete(idempotency_key, response_data, 200)
         return jsonify(response_data), 200
         
+    except RequestEntityTooLarge:
+        raise
+    except UpstreamBusyError as e:
+        # Tell the client when to retry instead of failing with a 500
+        logger.warning(f"Rejecting screenshot, {e.upstream} is busy: {str(e)}")
+        if current_idempotency_key.get():
+            idempotency_store.fail(current_idempotency_key.get())
+        return upstream_busy_response(e)
     except Exception as e:
         logger.error(f"Error processing screenshot: {str(e)}", exc_info=True)
+        if current_idempotency_key.get():
+            idempotency_store.fail(current_idempotency_key.get())
         return jsonify({"error": str(e)}), 500
 
-def analyze_image_with_claude(base64_image, mime_type, additional_instructions=''):
+@routes.route('/process-screenshots', methods=['POST'])
+def process_screenshots():
     """
-    Send the image to Claude Vision API for analysis
-    Returns the task information and the full response from Claude
+    Process several screenshots in one request, e.g. when clearing a backlog from the camera roll
+    Images are processed concurrently (at most BATCH_PARALLELISM at a time) and each one
+    gets its own result, so one failing image does not fail the whole batch
+    
+    Form fields:
+    - image: One part per screenshot
+    - additional_instructions: Either one value for all images or one value per image, in the same order
+    - original_size, original_dimensions: Optional, one value per image, as sent by the upload page
+    - debug: If set to 'true', returns detailed debug information per image
+    
+    An Idempotency-Key or X-Request-Id header applies to every image with the image's position
+    appended, so a retried batch replays the results of the images that were already processed
+    """
+    # Receive the multipart body before anything reads the form, so upload_read covers the whole upload
+    with stage_timer("upload_read"):
+        image_files = request.files.getlist('image')
+    
+    debug_mode = request.args.get('debug', 'false').lower() == 'true' or request.form.get('debug', 'false').lower() == 'true'
+    
+    if not image_files:
+        logger.error("No image files in batch request")
+        return jsonify({"error": "No image files provided"}), 400
+    if len(image_files) > BATCH_MAX_IMAGES:
+        return jsonify({"error": f"Too many images, at most {BATCH_MAX_IMAGES} are allowed per batch"}), 400
+    
+    # Match instructions to images: one shared value, or one value per image
+    instructions = request.form.getlist('additional_instructions') or request.args.getlist('additional_instructions')
+    if len(instructions) <= 1:
+        instructions = (instructions or ['']) * len(image_files)
+    elif len(instructions) != len(image_files):
+        return jsonify({"error": f"Got {len(instructions)} additional_instructions for {len(image_files)} images"}), 400
+    instructions = [value.strip() or "no additional instructions" for value in instructions]
+    
+    logger.info(f"Received batch of {len(image_files)} images")
+    
+    # Sizes reported by the upload page are only matched to images when there is one per image
+    original_sizes = request.form.getlist('original_size')
+    original_dimensions = request.form.getlist('original_dimensions')
+    
+    # Read every upload before the request ends; large uploads are memory-mapped
+    items = []
+    for index, image_file in enumerate(image_files):
+        image_data, _ = ingest_upload(image_file)
+        record_client_upload(original_sizes[index] if len(original_sizes) == len(image_files) else None, len(image_data),
+                             original_dimensions[index] if len(original_dimensions) == len(image_files) else None)
+        items.append({
+            "index": index,
+            "file_name": image_file.filename,
+            "image_data": image_data,
+            "mime_type": image_file.content_type or "image/jpeg",
+            "additional_instructions": instructions[index],
+            "idempotency_key": idempotency_key_for(batch_item_headers(request.headers, index), image_data,
+                                                   instructions[index], debug_mode, False)
+        })
+    
+    def process_item(item):
+        # Every image gets its own timings in debug responses and its own debug log sampling
+        current_timings.set(RequestTimings())
+        # Pool threads are reused, so set the key (or clear the previous image's) for every image
+        current_idempotency_key.set(None)
+        log_buffer = start_request_logging()
+        idempotency_key = item["idempotency_key"]
+        try:
+            # An image that was already processed (or is being processed) gets that result
+            if idempotency_key:
+                stored = claim_idempotency_key(idempotency_key)
+                if stored is not None:
+                    data, status, _ = stored
+                    finish_request_logging(log_buffer, failed=status != 200)
+                    if status == 200:
+                        return dict(data, index=item["index"], file_name=item["file_name"], replayed=True)
+                    return {"index": item["index"], "file_name": item["file_name"], "status": "error", "error": data.get("error")}
+                current_idempotency_key.set(idempotency_key)
+            
+            result = run_screenshot_pipeline(item["image_data"], item["mime_type"], item["file_name"],
+                                             item["additional_instructions"], debug_mode)
+            if idempotency_key:
+                idempotency_store.complete(idempotency_key, result, 200)
+            finish_request_logging(log_buffer, failed=False)
+            return dict(result, index=item["index"], file_name=item["file_name"])
+        except UpstreamBusyError as e:
+            logger.warning(f"Rejecting batch image {item['index']} ({item['file_name']}), {e.upstream} is busy: {str(e)}")
+            if idempotency_key:
+                idempotency_store.fail(idempotency_key)
+            finish_request_logging(log_buffer, failed=True)
+            return {"index": item["index"], "file_name": item["file_name"], "status": "error", "error": str(e),
+                    "upstream": e.upstream, "retry_after": e.retry_after}
+        except Exception as e:
+            logger.error(f"Error processing batch image {item['index']} ({item['file_name']}): {str(e)}", exc_info=True)
+            if idempotency_key:
+                idempotency_store.fail(idempotency_key)
+            finish_request_logging(log_buffer, failed=True)
+            return {"index": item["index"], "file_name": item["file_name"], "status": "error", "error": str(e)}
+    
+    with ThreadPoolExecutor(max_workers=min(BATCH_PARALLELISM, len(items)), thread_name_prefix="screenshot-batch") as pool:
+        results = list(pool.map(process_item, items))
+    
+    succeeded = sum(1 for result in results if result["status"] == "success")
+    failed = len(results) - succeeded
+    logger.info(f"Batch finished: {succeeded} succeeded, {failed} failed")
+    
+    busy = [result["retry_after"] for result in results if "retry_after" in result]
+    if failed == 0:
+        status, http_status = "success", 200
+    elif len(busy) == len(results):
+        # Every image was turned away for capacity, so the whole batch should be retried later
+        status, http_status = "error", 503
+    elif succeeded == 0:
+        status, http_status = "error", 500
+    else:
+        status, http_status = "partial", 207
+    
+    response = jsonify({
+        "status": status,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": failed,
+        "results": results
+    })
+    if http_status == 503:
+        response.headers["Retry-After"] = str(max(busy))
+    return response, http_status
+
+def run_screenshot_pipeline(image_data, mime_type, file_name, additional_instructions, debug_mode=False):
+    """
+    Run the Claude and Todoist stages for an uploaded screenshot
+    Returns the response data that is sent back to the client
     """
     try:
-        # Handle empty additional instructions with a default message
-        if not additional_instructions or additional_instructions.strip() == '':
-            additional_instructions = "no additional instructions"
+        with stage_timer("total"):
+            response_data = _run_screenshot_pipeline(image_data, mime_type, file_name, additional_instructions, debug_mode)
+    except Exception:
+        SCREENSHOT_REQUESTS.labels(outcome="error").inc()
+        raise
+    SCREENSHOT_REQUESTS.labels(outcome="success").inc()
+    return response_data
+
+def _run_screenshot_pipeline(image_data, mime_type, file_name, additional_instructions, debug_mode):
+    rss_start_kb, peak_start_kb = memory_usage()
+    
+    # Store the original image data for file attachment
+    original_image_data = image_data
+    
+    # Start the Sync API upload right away and let it run while the image is analyzed
+    upload_future = None
+    if starts_parallel_upload(original_image_data):
+        # Run in a copy of the current context so the upload shows up in this request's timings
+        upload_future = upload_executor.submit(contextvars.copy_context().run, upload_file_to_todoist,
+                                               original_image_data, attachment_filename(), mime_type or "image/jpeg")
+    
+    # Analyze the image, reusing an earlier result for the same screenshot when possible
+    try:
+        task_info, anthropic_response, analysis_info = analyze_screenshot(image_data, mime_type, additional_instructions)
+    except Exception:
+        # No task will be created; an upload that is still waiting for a worker is dropped
+        if upload_future is not None:
+            upload_future.cancel()
+        raise
+    
+    # Create task in Todoist with the original image data
+    logger.info(f"Creating Todoist task: {task_info}")
+    logger.debug(f"Image data type: {type(original_image_data)}, length: {len(original_image_data)} bytes")
+    task_fields = todoist_task_fields(anthropic_response)
+    if OUTBOX_MODE == "always":
+        todoist_response = queue_todoist_task(task_info, original_image_data, mime_type, task_fields=task_fields)
+    else:
+        try:
+            todoist_response = create_todoist_task(task_info, original_image_data, mime_type,
+                                                   upload_future=upload_future, task_fields=task_fields)
+        except Exception as e:
+            if OUTBOX_MODE != "fallback":
+                raise
+            # Keep the analysis and let the outbox create the task once Todoist recovers
+            logger.warning(f"Todoist task creation failed, queueing the task in the outbox: {str(e)}")
+            todoist_response = queue_todoist_task(task_info, original_image_data, mime_type, error=e,
+                                                  task_fields=task_fields)
+    
+    # Report memory so workers can be sized; the peak is process-wide, so it only
+    # reflects this request when requests are not processed concurrently
+    rss_end_kb, peak_end_kb = memory_usage()
+    memory_info = {
+        "upload_memory_mapped": isinstance(original_image_data, mmap.mmap),
+        "rss_start_kb": rss_start_kb,
+        "rss_end_kb": rss_end_kb,
+        "peak_rss_kb": peak_end_kb,
+        "peak_rss_increase_kb": peak_end_kb - peak_start_kb if peak_end_kb is not None else None
+    }
+    logger.info(f"Request memory: rss {rss_start_kb} -> {rss_end_kb} KB, peak {peak_end_kb} KB "
+                f"(+{memory_info['peak_rss_increase_kb']} KB)")
+    
+    return build_screenshot_response(task_info, anthropic_response, analysis_info, todoist_response,
+                                     original_image_data, mime_type, file_name, debug_mode, memory_info)
+
+def starts_parallel_upload(image_data):
+    """
+    Whether to start the Sync API upload while Claude analyzes the image, shared by both apps
+    The upload does not depend on Claude's output. Without Sync API batching, tasks are attached
+    with the REST API; while that is failing the upload is needed anyway, so it is also started
+    early when parallel uploads are disabled
+    """
+    return bool(image_data) and OUTBOX_MODE != "always" and (
+        PARALLEL_UPLOAD or (not TODOIST_SYNC_BATCHING and attachment_breaker.skip_rest(len(image_data))))
+
+def rest_skip_counted(upload_future):
+    """Whether starts_parallel_upload() already counted this request's REST attachment skip"""
+    return upload_future is not None and not PARALLEL_UPLOAD
+
+def build_screenshot_response(task_info, anthropic_response, analysis_info, todoist_response,
+                              image_data, mime_type, file_name, debug_mode, memory_info=None):
+    """Build the response data for a processed screenshot, shared by the WSGI and ASGI apps"""
+    # Tasks in the outbox are created (and get their attachment) later
+    task_queued = "outbox_id" in todoist_response
+    
+    # Check if file attachment was successful
+    file_attached = "file_attachment" in todoist_response
+    if not task_queued:
+        logger.info(f"File attachment status: {'SUCCESS' if file_attached else 'FAILED'}")
+    
+    # Take the title from the tool call, or remove the time estimate from a task line
+    task = anthropic_response.get("task")
+    if task:
+        task_title = task["title"]
+    elif is_task_line(task_info):
+        task_title = task_info[4:].strip()
+    else:
+        task_title = task_info
+    
+    # Prepare response data
+    if debug_mode:
+        # Return detailed response for debugging
+        response_data = {
+            "status": "success",
+            "task": task_info,
+            "title": task_title,
+            "anthropic_response": anthropic_response,
+            "todoist_response": todoist_response,
+            "task_created": not task_queued,
+            "task_queued": task_queued,
+            "file_attached": file_attached,
+            "diagnostics": {
+                "image_size": len(image_data),
+                "mime_type": mime_type,
+                "file_name": file_name,
+                "has_todoist_key": bool(TODOIST_API_KEY),
+                "todoist_key_length": len(TODOIST_API_KEY) if TODOIST_API_KEY else 0,
+                "result_cache": result_cache.stats(),
+                "attachment_breaker": attachment_breaker.stats(),
+                "analysis": analysis_info
+            }
+        }
+        if memory_info is not None:
+            response_data["diagnostics"]["memory"] = memory_info
         
-        # Format prompt with additional instructions
-        formatted_prompt = CLAUDE_PROMPT.format(
-            additional_instructions=additional_instructions
-        )
+        # Add the per-stage timings so slow requests can be broken down
+        timings = current_timings.get()
+        if timings is not None:
+            response_data["timings"] = timings.as_dict()
+        
+        # Add file attachment info if available
+        if file_attached:
+            response_data["file_attachment"] = todoist_response.get("file_attachment", {})
+            response_data["attachment_details"] = {
+                "comment_id": todoist_response["file_attachment"].get("id"),
+                "task_id": todoist_response["id"]
+            }
+    else:
+        # Return simplified response for regular use
+        response_data = {
+            "status": "success",
+            "title": task_title,
+            "task_created": not task_queued,
+            "task_queued": task_queued,
+            "file_attached": file_attached
+        }
+    
+    # Estimate, priority and labels are only known from a tool call
+    if task:
+        response_data.update({key: value for key, value in task.items() if key != "title"})
+    
+    return response_data
+
+def analyze_screenshot(image_data, mime_type, additional_instructions):
+    """
+    Analyze a screenshot, serving repeated or near-identical screenshots from the result cache
+    Returns the task information, the (possibly cached) response from Claude and
+    diagnostics about the cache lookup and image preprocessing
+    """
+    fingerprint, cached, analysis_info = lookup_cached_analysis(image_data, additional_instructions)
+    if cached:
+        return cached[0], cached[1], analysis_info
+    
+    base64_image, mime_type = prepare_claude_image(image_data, mime_type, analysis_info)
+    
+    # Call Claude Vision API
+    logger.info("Calling Claude Vision API")
+    task_info, anthropic_response = analyze_image_with_claude(base64_image, mime_type, additional_instructions)
+    
+    store_analysis(fingerprint, task_info, anthropic_response)
+    return task_info, anthropic_response, analysis_info
+
+def lookup_cached_analysis(image_data, additional_instructions):
+    """
+    Look up an earlier analysis of the same (or a near-identical) screenshot
+    Returns the fingerprint to store a new result under, the cached task information and
+    Claude response (or None on a miss) and the analysis diagnostics
+    """
+    analysis_info = {"result_cache": "disabled"}
+    if not result_cache.enabled:
+        return None, None, analysis_info
+    
+    fingerprint = result_cache.fingerprint(image_data, additional_instructions)
+    entry, match = result_cache.get(fingerprint)
+    analysis_info["result_cache"] = match or "miss"
+    RESULT_CACHE_LOOKUPS.labels(result=match or "miss").inc()
+    if not entry:
+        return fingerprint, None, analysis_info
+    
+    logger.info(f"Result cache {match} hit for image {fingerprint['sha256'][:12]}, skipping Claude call")
+    anthropic_response = dict(entry["anthropic_response"], cached=True, cache_match=match)
+    return fingerprint, (entry["task_info"], anthropic_response), analysis_info
+
+def prepare_claude_image(image_data, mime_type, analysis_info):
+    """
+    Normalize and base64 encode a screenshot for Claude
+    Returns the base64 image and its mime type, and adds the preprocessing stats to analysis_info
+    """
+    # Shrink the image to what Claude can actually use before encoding it
+    with stage_timer("image_preprocess"):
+        image_data, mime_type, analysis_info["image_preprocessing"] = normalize_image(image_data, mime_type)
+    
+    # Convert image to base64 for Claude
+    with stage_timer("base64_encode"):
+        base64_image = base64.b64encode(image_data).decode('utf-8')
+    return base64_image, mime_type
+
+def store_analysis(fingerprint, task_info, anthropic_response):
+    """Cache a Claude analysis under the screenshot's fingerprint"""
+    # Only cache valid replies so a retry can still fix a bad reply
+    if fingerprint and validate_task(task_info) is None:
+        result_cache.put(fingerprint, task_info, anthropic_response)
+
+def claim_idempotency_key(key):
+    """
+    Claim an idempotency key for the current request, waiting while a request with the same key runs
+    Returns the response to replay as (data, status, headers), or None once the key is claimed
+    """
+    while True:
+        stored, running = idempotency_store.begin(key)
+        if running is None:
+            if stored is not None:
+                logger.info(f"Replaying stored response for idempotency key {key[:60]}")
+            return stored
+        logger.info(f"Waiting for the running request with idempotency key {key[:60]}")
+        if not idempotency_store.wait(running):
+            return ({"error": "A request with this idempotency key is still being processed"}, 409,
+                    {"Retry-After": "5"})
+
+def submit_screenshot_job(image_data, mime_type, file_name, additional_instructions, debug_mode=False):
+    """
+    Queue a screenshot for background processing on the job worker pool
+    Returns a 202 response with the job id, or 503 when the pool is saturated
+    """
+    job_id = queue_screenshot_job(image_data, mime_type, file_name, additional_instructions, debug_mode)
+    if job_id is None:
+        response = jsonify({"error": "Too many screenshots are being processed, please retry later"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+    
+    response = jsonify({
+        "status": "queued",
+        "job_id": job_id,
+        "status_url": f"jobs/{job_id}"
+    })
+    response.headers["Location"] = f"jobs/{job_id}"
+    return response, 202
+
+def queue_screenshot_job(image_data, mime_type, file_name, additional_instructions, debug_mode=False):
+    """
+    Add a screenshot job to the job worker pool
+    Returns the job id, or None when the pool is saturated
+    """
+    now = time.time()
+    with jobs_lock:
+        # Drop finished jobs whose results have expired
+        expired = [job_id for job_id, job in jobs.items()
+                   if job["finished_at"] and now - job["finished_at"] > JOB_RESULT_TTL]
+        for job_id in expired:
+            del jobs[job_id]
         
-        # Prepare the request to Claude
-        messages = [{
+        # Bound the number of queued and running jobs
+        pending = sum(1 for job in jobs.values() if job["status"] in ("queued", "running"))
+        if pending >= JOB_WORKERS + JOB_QUEUE_LIMIT:
+            logger.warning(f"Job queue is full ({pending} pending jobs), rejecting request")
+            return None
+        
+        job_id = uuid.uuid4().hex
+        jobs[job_id] = {
+            "id": job_id,
+            "status": "queued",
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None
+        }
+    
+    # Run in a copy of the current context so the job's Todoist writes use the request's idempotency key
+    job_executor.submit(contextvars.copy_context().run, _run_screenshot_job,
+                        job_id, image_data, mime_type, file_name, additional_instructions, debug_mode)
+    logger.info(f"Queued screenshot job {job_id} ({pending + 1} pending jobs)")
+    return job_id
+
+def _run_screenshot_job(job_id, image_data, mime_type, file_name, additional_instructions, debug_mode):
+    """Worker pool entry point for a queued screenshot job"""
+    current_timings.set(RequestTimings())
+    log_buffer = start_request_logging()
+    with jobs_lock:
+        jobs[job_id]["status"] = "running"
+        jobs[job_id]["started_at"] = time.time()
+    
+    try:
+        result = run_screenshot_pipeline(image_data, mime_type, file_name, additional_instructions, debug_mode)
+        with jobs_lock:
+            jobs[job_id]["status"] = "succeeded"
+            jobs[job_id]["result"] = result
+    except Exception as e:
+        logger.error(f"Screenshot job {job_id} failed: {str(e)}", exc_info=True)
+        with jobs_lock:
+            jobs[job_id]["status"] = "failed"
+            jobs[job_id]["error"] = str(e)
+    finally:
+        with jobs_lock:
+            jobs[job_id]["finished_at"] = time.time()
+            failed = jobs[job_id]["status"] == "failed"
+        finish_request_logging(log_buffer, failed=failed)
+
+@routes.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """
+    Report the status of an async screenshot job
+    Returns 202 while the job is queued or running, and 200 with the result once it has finished
+    """
+    with jobs_lock:
+        job = jobs.get(job_id)
+        job = dict(job) if job else None
+    
+    if not job:
+        return jsonify({"error": "Unknown or expired job id", "job_id": job_id}), 404
+    
+    if job["status"] in ("queued", "running"):
+        return jsonify(job), 202
+    return jsonify(job), 200
+
+@routes.route('/stats', methods=['GET'])
+def stats():
+    """Report internal counters for the result cache, image preprocessing, client-side resizing, model routing, outbound limits, Todoist client, attachment breaker, write batching and outbox, async job pool, idempotency store, logging, startup timings and static page cache"""
+    with jobs_lock:
+        job_counts = {}
+        for job in jobs.values():
+            job_counts[job["status"]] = job_counts.get(job["status"], 0) + 1
+    with image_preprocessing_lock:
+        preprocessing = dict(image_preprocessing_totals)
+    with client_upload_lock:
+        client_uploads = dict(client_upload_totals)
+    with model_routing_lock:
+        routing = {model: dict(totals) for model, totals in model_routing_totals.items()}
+    return jsonify({
+        "result_cache": result_cache.stats(),
+        "image_preprocessing": preprocessing,
+        "client_uploads": client_uploads,
+        "model_routing": routing,
+        "outbound_limits": {upstream: limiter.stats() for upstream, limiter in outbound_limiters.items()},
+        "todoist_client": get_todoist_client().stats(),
+        "attachment_breaker": attachment_breaker.stats(),
+        "todoist_sync_batcher": get_sync_batcher().stats() if TODOIST_SYNC_BATCHING else None,
+        "todoist_outbox": get_outbox().stats() if OUTBOX_MODE != "off" else None,
+        "jobs": job_counts,
+        "idempotency": idempotency_store.stats(),
+        "logging": log_queue_handler.stats() if log_queue_handler else {"mode": LOG_MODE},
+        "startup": dict(startup_timings, pid=os.getpid()),
+        "static_assets": static_assets.stats()
+    }), 200
+
+@routes.route('/metrics', methods=['GET'])
+def metrics():
+    """Expose Prometheus metrics, aggregated over all workers when running multi-process"""
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+def build_claude_request(base64_image, mime_type, additional_instructions='', structured=False):
+    """
+    Build the system prompt and messages of a Claude Vision request for a base64 encoded screenshot
+    With structured set, Claude is made to reply with a create_task tool call instead of a task line
+    Returns keyword arguments for messages.create()
+    """
+    # Handle empty additional instructions with a default message
+    if not additional_instructions or additional_instructions.strip() == '':
+        additional_instructions = "no additional instructions"
+    user_prompt = CLAUDE_TOOL_USER_PROMPT if structured else CLAUDE_USER_PROMPT
+    
+    system_block = {"type": "text", "text": CLAUDE_TOOL_SYSTEM_PROMPT if structured else CLAUDE_SYSTEM_PROMPT}
+    if CLAUDE_PROMPT_CACHE:
+        system_block["cache_control"] = {"type": "ephemeral"}
+    
+    claude_request = {
+        "system": [system_block],
+        "messages": [{
             "role": "user",
             "content": [
-                {
-                    "type": "text",
-                    "text": formatted_prompt
-                },
                 {
                     "type": "image",
                     "source": {
@@ -329,80 +3050,547 @@ def analyze_image_with_claude(base64_image, mime_type, additional_instructions='
                         "media_type": mime_type,
                         "data": base64_image
                     }
+                },
+                {
+                    "type": "text",
+                    "text": user_prompt.format(additional_instructions=additional_instructions)
                 }
             ]
         }]
+    }
+    if structured:
+        # The pinned SDK predates tool use, so the tool and the forced tool_choice are sent as extra fields
+        claude_request["max_tokens"] = CLAUDE_TOOL_MAX_TOKENS
+        claude_request["extra_body"] = {
+            "tools": [CLAUDE_TASK_TOOL],
+            "tool_choice": {"type": "tool", "name": CLAUDE_TASK_TOOL["name"]}
+        }
+        return claude_request
+    
+    claude_request["max_tokens"] = CLAUDE_MAX_TOKENS
+    if CLAUDE_STOP_SEQUENCES:
+        claude_request["stop_sequences"] = CLAUDE_STOP_SEQUENCES
+    return claude_request
+
+def is_task_line(line):
+    """Check if a line of Claude's reply is in the expected "XY: Title" format"""
+    return len(line) >= 5 and line[0].isdigit() and line[1].isdigit() and line[2:4] == ": "
+
+class TaskLineScanner:
+    """Spot the task line in streamed reply text as soon as the line is complete"""
+    
+    def __init__(self):
+        self.text = ""
+        self.position = 0
+    
+    def feed(self, delta):
+        """Add a text delta; returns the task line once it has arrived, otherwise None"""
+        self.text += delta
+        while True:
+            newline = self.text.find("\n", self.position)
+            if newline < 0:
+                return None
+            line = self.text[self.position:newline]
+            self.position = newline + 1
+            if is_task_line(line):
+                return line.strip()
+    
+    def finish(self):
+        """Check the last line once the stream has ended, as it has no newline after it"""
+        line = self.text[self.position:]
+        self.position = len(self.text)
+        return line.strip() if is_task_line(line) else None
+
+def record_claude_stream(model, start_time, first_token_time, task_time, stopped_early):
+    """
+    Record how long a streamed Claude call took to produce the task line
+    task_time is None when the reply had no task line, which is then not recorded
+    Returns the streaming details for the debug response
+    """
+    end_time = time.perf_counter()
+    if task_time is not None:
+        STAGE_LATENCY.labels(stage="claude_time_to_task").observe(task_time - start_time)
+        timings = current_timings.get()
+        if timings is not None:
+            timings.record("claude_time_to_task", start_time, task_time)
+    else:
+        logger.debug(f"The {model} stream ended without a task line")
+    if stopped_early:
+        logger.debug(f"Stopped reading the {model} stream once the task line arrived")
+    return {
+        "streamed": True,
+        "stopped_early": stopped_early,
+        "time_to_first_token_ms": round((first_token_time - start_time) * 1000, 1) if first_token_time else None,
+        "time_to_task_ms": round((task_time - start_time) * 1000, 1) if task_time is not None else None,
+        "total_ms": round((end_time - start_time) * 1000, 1)
+    }
+
+def call_claude(model, claude_request, stream_reply=CLAUDE_STREAMING):
+    """
+    Run one Claude analysis call, streaming the reply if stream_reply is set
+    Returns the (possibly partial) message and the streaming details, or None when not streamed
+    """
+    if not stream_reply:
+        response = get_anthropic_client().messages.create(model=model, **claude_request)
+        return response, None
+    
+    start_time = time.perf_counter()
+    first_token_time = task_time = None
+    stopped_early = False
+    scanner = TaskLineScanner()
+    with get_anthropic_client().messages.stream(model=model, **claude_request) as stream:
+        for text in stream.text_stream:
+            first_token_time = first_token_time or time.perf_counter()
+            if scanner.feed(text):
+                # Everything after the task line is discarded anyway, so close the stream
+                task_time = time.perf_counter()
+                stopped_early = True
+                break
+        else:
+            if scanner.finish():
+                task_time = time.perf_counter()
+        response = stream.current_message_snapshot if stopped_early else stream.get_final_message()
+    return response, record_claude_stream(model, start_time, first_token_time, task_time, stopped_early)
+
+def format_task_line(task):
+    """
+    Write structured task fields as the "XY: Title" line used as the Todoist task content
+    X is the number of hours and Y the number of tens of minutes, at most 9 hours 50 minutes
+    """
+    minutes = task["estimated_minutes"]
+    # Round short tasks up to 10 minutes, a zero estimate is left for validation to reject
+    tens = min(59, max(1, round(minutes / 10))) if minutes > 0 else 0
+    hours, tens = divmod(tens, 6)
+    return f"{hours}{tens}: {task['title']}"
+
+def parse_task_tool_input(tool_input):
+    """
+    Check the input Claude gave the create_task tool
+    Returns the task fields, or None if the required ones are missing or have the wrong type
+    """
+    if not isinstance(tool_input, dict):
+        return None
+    title = tool_input.get("title")
+    minutes = tool_input.get("estimated_minutes")
+    if not isinstance(title, str) or isinstance(minutes, bool) or not isinstance(minutes, (int, float)):
+        return None
+    # The title becomes a single line of the task content
+    title = " ".join(title.split()).strip("*").strip()
+    if not title:
+        return None
+    
+    task = {"title": title, "estimated_minutes": int(round(minutes))}
+    priority = tool_input.get("priority")
+    if isinstance(priority, int) and not isinstance(priority, bool) and 1 <= priority <= 4:
+        task["priority"] = priority
+    labels = tool_input.get("labels")
+    if isinstance(labels, list):
+        labels = [label.strip() for label in labels if isinstance(label, str) and label.strip()]
+        if labels:
+            task["labels"] = labels[:3]
+    return task
+
+def parse_claude_response(response, structured=False):
+    """
+    Extract the task from a Claude response
+    With structured set, the task is read from the create_task tool call; if that is missing
+    or unusable, the returned task information is None so the caller can ask for text instead
+    Returns the task information and the full response from Claude
+    """
+    # Extract the response text (a stream that was stopped early may have no content yet)
+    text_blocks = [block.text for block in response.content if getattr(block, "type", "text") == "text"]
+    tool_inputs = [block.input for block in response.content if getattr(block, "type", None) == "tool_use"]
+    response_text = text_blocks[0] if text_blocks else ""
+    
+    # Store the full response for debugging; input_tokens only counts the uncached part
+    # of the prompt, the cached prefix is reported in the cache token counts
+    usage = {
+        "input_tokens": response.usage.input_tokens,
+        "output_tokens": response.usage.output_tokens,
+        "cache_read_input_tokens": getattr(response.usage, "cache_read_input_tokens", None) or 0,
+        "cache_creation_input_tokens": getattr(response.usage, "cache_creation_input_tokens", None) or 0
+    }
+    anthropic_response = {
+        "model": response.model,
+        "id": response.id,
+        "role": "assistant",
+        "content": response_text,
+        "usage": usage
+    }
+    CLAUDE_TOKENS.labels(type="input").inc(usage["input_tokens"])
+    CLAUDE_TOKENS.labels(type="output").inc(usage["output_tokens"])
+    CLAUDE_TOKENS.labels(type="cache_read").inc(usage["cache_read_input_tokens"])
+    CLAUDE_TOKENS.labels(type="cache_creation").inc(usage["cache_creation_input_tokens"])
+    
+    if structured:
+        anthropic_response["output_mode"] = "tool"
+        anthropic_response["tool_input"] = tool_inputs[0] if tool_inputs else None
+        task = parse_task_tool_input(tool_inputs[0]) if tool_inputs else None
+        if task is None:
+            logger.warning(f"Claude's reply didn't fill in the task tool (stop reason {response.stop_reason}): "
+                           f"{tool_inputs[0] if tool_inputs else response_text}")
+            TASK_PARSE_FAILURES.inc()
+            return None, anthropic_response
+        anthropic_response["task"] = task
+        task_info = format_task_line(task)
+        logger.info(f"Task from Claude's tool call: {task_info}")
+        return task_info, anthropic_response
+    
+    # Clean up the response (remove any extra text, just get the task format)
+    # The response should be in the format "XY: *Task Title*"
+    response_lines = response_text.strip().split('\n')
+    task_info = None
+    for line in response_lines:
+        # Look for a line that matches our expected format
+        if is_task_line(line):
+            task_info = line.strip()
+            break
+    
+    # If we couldn't find a properly formatted line, return the whole response
+    if not task_info:
+        logger.warning(f"Claude response didn't match expected format: {response_text}")
+        TASK_PARSE_FAILURES.inc()
+        task_info = response_text.strip()
+    
+    logger.info(f"Extracted task info from Claude: {task_info}")
+    return task_info, anthropic_response
+
+def validate_task(task_info):
+    """
+    Check a task extracted from Claude's reply
+    Returns None if it is usable, otherwise the reason it should be escalated to a larger model
+    """
+    if not is_task_line(task_info):
+        return "unparseable"
+    if task_info[:2] == "00":
+        return "zero_estimate"
+    title = task_info[4:].strip().strip("*").strip()
+    if not title or title.lower() in ("title of task", "task title"):
+        return "empty_title"
+    if len(title.split()) > CLAUDE_MAX_TITLE_WORDS:
+        return "title_too_long"
+    return None
+
+def route_model_tier(routing, model, start_time, task_info, last_tier):
+    """
+    Record the outcome of one model tier's analysis call
+    Returns True if the reply is accepted, False if the next tier should be tried
+    """
+    duration = time.perf_counter() - start_time
+    reason = validate_task(task_info)
+    accepted = reason is None or last_tier
+    outcome = "accepted" if accepted else "escalated"
+    
+    CLAUDE_TIER_LATENCY.labels(model=model).observe(duration)
+    CLAUDE_TIER_CALLS.labels(model=model, outcome=outcome).inc()
+    with model_routing_lock:
+        totals = model_routing_totals.setdefault(model, {"accepted": 0, "escalated": 0, "total_ms": 0.0})
+        totals[outcome] += 1
+        totals["total_ms"] = round(totals["total_ms"] + duration * 1000, 1)
+    
+    routing.append({"model": model, "duration_ms": round(duration * 1000, 1), "outcome": outcome, "reason": reason})
+    if not accepted:
+        logger.info(f"Escalating analysis from {model} ({reason}) after {duration * 1000:.0f} ms")
+    return accepted
+
+class ClaudeAnalysis:
+    """
+    Decide which Claude calls an analysis makes and which reply it uses
+    Shared by the WSGI and ASGI apps, which only send the calls. Models in CLAUDE_MODEL_TIERS are
+    tried in order until one gives a valid reply, and an unusable tool reply is asked for again
+    as a text reply from the same model. API errors are not escalated: rate limiting, overload
+    and connection errors say nothing about the reply, and a larger model would only add load
+    """
+    
+    def __init__(self, base64_image, mime_type, additional_instructions=''):
+        self.base64_image = base64_image
+        self.mime_type = mime_type
+        self.additional_instructions = additional_instructions
+        self.structured = CLAUDE_OUTPUT_MODE == "tool"
+        self.claude_request = build_claude_request(base64_image, mime_type, additional_instructions, self.structured)
+        self.text_request = None if self.structured else self.claude_request
+        self.tier = 0
+        self.text_fallback = False
+        self.start_time = None
+        self.routing = []
+        self.result = None
+    
+    @property
+    def model(self):
+        return CLAUDE_MODEL_TIERS[self.tier]
+    
+    @property
+    def last_tier(self):
+        return self.tier == len(CLAUDE_MODEL_TIERS) - 1
+    
+    def next_call(self):
+        """The next call to send as (model, claude_request, stream_reply), or None once a reply was accepted"""
+        if self.result is not None:
+            return None
+        if self.text_fallback:
+            return self.model, self.text_request, CLAUDE_STREAMING
+        self.start_time = time.perf_counter()
+        return self.model, self.claude_request, CLAUDE_STREAMING and not self.structured
+    
+    def handle_reply(self, response, streaming):
+        """Parse a reply and accept it, ask for a text reply instead, or escalate to the next tier"""
+        task_info, anthropic_response = parse_claude_response(response, self.structured and not self.text_fallback)
+        if task_info is None:
+            # The tool reply was unusable, ask the same model for a task line instead
+            logger.info(f"Falling back to a text reply from {self.model}")
+            self.text_fallback = True
+            self.text_request = self.text_request or build_claude_request(self.base64_image, self.mime_type,
+                                                                          self.additional_instructions)
+            return
+        if self.text_fallback:
+            anthropic_response["output_mode"] = "text_fallback"
+        if streaming:
+            anthropic_response["streaming"] = streaming
+        if route_model_tier(self.routing, self.model, self.start_time, task_info, self.last_tier):
+            anthropic_response["routing"] = self.routing
+            self.result = (task_info, anthropic_response)
+        else:
+            self.tier += 1
+            self.text_fallback = False
+
+def claude_failure(error):
+    """
+    Turn an error from the Claude analysis into the exception that is reported, shared by both apps
+    Rate limiting and overload (after the SDK's own retries) become UpstreamBusyError, so the
+    client is told when to retry
+    """
+    if isinstance(error, UpstreamBusyError):
+        return error
+    if isinstance(error, anthropic.APIStatusError) and error.status_code in CONGESTION_STATUS_CODES:
+        logger.warning(f"Claude API is rate limiting or overloaded ({error.status_code}): {str(error)}")
+        return UpstreamBusyError.from_response("anthropic", error.response)
+    logger.error(f"Error calling Claude API: {str(error)}", exc_info=error)
+    return Exception(f"Failed to analyze image with Claude: {str(error)}")
+
+def analyze_image_with_claude(base64_image, mime_type, additional_instructions=''):
+    """
+    Send the image to Claude Vision API for analysis
+    ClaudeAnalysis decides which models are called and which reply is used
+    Returns the task information and the full response from Claude
+    """
+    try:
+        analysis = ClaudeAnalysis(base64_image, mime_type, additional_instructions)
+        call = analysis.next_call()
+        while call is not None:
+            model, claude_request, stream_reply = call
+            logger.debug(f"Sending request to Claude API ({model})")
+            with outbound_limiters["anthropic"].call(), stage_timer("claude_call"):
+                response, streaming = call_claude(model, claude_request, stream_reply=stream_reply)
+            analysis.handle_reply(response, streaming)
+            call = analysis.next_call()
+        return analysis.result
+    except Exception as e:
+        raise claude_failure(e)
+
+def upload_file_to_todoist(binary_data, filename, mime_type):
+    """
+    Upload a file with the Todoist Sync API
+    This does not depend on the task, so it can run while Claude is still analyzing the image
+    Returns the upload details, or None if the upload failed
+    """
+    try:
+        # Sync API for file uploads
+        upload_url = "/sync/v9/uploads/add"
         
-        # Call Claude API
-        logger.debug("Sending request to Claude API")
-        response = client.messages.create(
-            model="claude-3-sonnet-20240229",
-            max_tokens=300,
-            messages=messages
-        )
+        # Stream the multipart/form-data payload from the shared upload buffer
+        body = MultipartBody('file', filename, binary_data, mime_type)
         
-        # Extract the response text
-        response_text = response.content[0].text
-        
-        # Store the full response for debugging
-        anthropic_response = {
-            "model": response.model,
-            "id": response.id,
-            "role": "assistant",
-            "content": response_text,
-            "usage": {
-                "input_tokens": response.usage.input_tokens,
-                "output_tokens": response.usage.output_tokens
-            }
-        }
+        # Upload the file to Todoist Sync API
+        logger.debug(f"Making Sync API request to {upload_url}")
+        with stage_timer("todoist_sync_upload"):
+            upload_response = get_todoist_client().post(upload_url, data=body, headers={"Content-Type": body.content_type})
         
-        # Clean up the response (remove any extra text, just get the task format)
-        # The response should be in the format "XY: *Task Title*"
-        response_lines = response_text.strip().split('\n')
-        task_info = None
-        for line in response_lines:
-            # Look for a line that matches our expected format
-            if len(line) >= 5 and line[0].isdigit() and line[1].isdigit() and line[2:4] == ": ":
-                task_info = line.strip()
-                break
+        logger.debug(f"Sync API upload response status: {upload_response.status_code}")
+        logger.debug(f"Sync API upload response body: {upload_response.text}")
         
-        # If we couldn't find a properly formatted line, return the whole response
-        if not task_info:
-            logger.warning(f"Claude response didn't match expected format: {response_text}")
-            task_info = response_text.strip()
+        if upload_response.status_code != 200:
+            logger.error(f"Error uploading file with Sync API: {upload_response.status_code} - {upload_response.text}")
+            return None
         
-        logger.info(f"Extracted task info from Claude: {task_info}")
-        return task_info, anthropic_response
+        # Get the upload details
+        upload_data = upload_response.json()
+        if not upload_data.get("file_url"):
+            logger.error(f"File upload succeeded but missing file_url. Response: {upload_data}")
+            return None
         
+        logger.info(f"File uploaded successfully via Sync API, URL: {upload_data['file_url']}")
+        return upload_data
     except Exception as e:
-        logger.error(f"Error calling Claude API: {str(e)}", exc_info=True)
-        raise Exception(f"Failed to analyze image with Claude: {str(e)}")
+        logger.error(f"Error with Sync API upload: {str(e)}", exc_info=True)
+        return None
+
+def attach_uploaded_file(task, upload_data, filename, mime_type):
+    """
+    Attach a file uploaded with the Sync API to the task as a comment
+    Adds the comment to the task as "file_attachment" on success
+    """
+    comment_url = "/rest/v2/comments"
+    
+    # According to Todoist API, for file attachments, we need to follow their specific format
+    comment_data = {
+        "task_id": task["id"],
+        "content": "Screenshot attachment",  # Adding a meaningful content message
+        "attachment": {
+            "resource_type": "image",  # Changed from "file" to "image"
+            "file_url": upload_data["file_url"],
+            "file_name": upload_data.get("file_name", filename),
+            "file_type": upload_data.get("file_type", mime_type)
+        }
+    }
+    
+    logger.debug(f"Attaching file to task with comment data: {comment_data}")
+    
+    with stage_timer("todoist_comment"):
+        comment_response = get_todoist_client().post(comment_url, json=comment_data, request_id=todoist_request_id("comment"))
+    
+    logger.debug(f"Comment response status: {comment_response.status_code}")
+    logger.debug(f"Comment response body: {comment_response.text}")
+    
+    if comment_response.status_code != 200:
+        logger.error(f"Error attaching file to task: {comment_response.status_code} - {comment_response.text}")
+    else:
+        logger.info("File attached to task successfully")
+        # Add comment info to the task response
+        task["file_attachment"] = comment_response.json()
+    return task
+
+def todoist_task_fields(anthropic_response):
+    """
+    Todoist fields for the priority and labels Claude set in its create_task tool call
+    Claude is asked for the same priority scale as the Todoist API, 1 (normal) to 4 (urgent)
+    """
+    task = anthropic_response.get("task") or {}
+    return {field: task[field] for field in TODOIST_TASK_FIELDS if task.get(field)}
+
+def build_task_data(task_info, task_fields=None):
+    """Build the REST API request body that creates a task, shared by both apps"""
+    return {
+        "content": task_info,
+        "due_string": "today",  # Default due date is today
+        **(task_fields or {})
+    }
+
+def attachment_filename():
+    """Default file name for a screenshot attachment"""
+    return f"screenshot_{int(time.time())}.jpg"
+
+def build_task_commands(task_info, upload_data=None, filename=None, mime_type=None, task_fields=None):
+    """
+    Build the Sync API commands that add a task and, if a file was uploaded, attach it in a comment
+    The comment refers to the task by its temp id, so both can be sent in the same batch
+    """
+    task_temp_id = todoist_request_id("item_add_temp_id")
+    commands = [{
+        "type": "item_add",
+        "temp_id": task_temp_id,
+        "uuid": todoist_request_id("item_add"),
+        "args": {"content": task_info, "due": {"string": "today"}, **(task_fields or {})}
+    }]
+    if upload_data:
+        commands.append({
+            "type": "note_add",
+            "temp_id": todoist_request_id("note_add_temp_id"),
+            "uuid": todoist_request_id("note_add"),
+            "args": {
+                "item_id": task_temp_id,
+                "content": "Screenshot attachment",
+                "file_attachment": dict(upload_data,
+                                        file_name=upload_data.get("file_name", filename),
+                                        file_type=upload_data.get("file_type", mime_type),
+                                        resource_type="image")
+            }
+        })
+    return commands
+
+def apply_sync_result(task_info, commands, result):
+    """
+    Turn the Sync API result of build_task_commands() into a task like the REST API returns
+    Raises if the task was not added; a failed comment only leaves out "file_attachment"
+    """
+    item_command = commands[0]
+    status = result["sync_status"].get(item_command["uuid"])
+    if status != "ok":
+        raise Exception(f"Todoist Sync API error adding task: {status}")
+    task = {
+        "id": result["temp_id_mapping"].get(item_command["temp_id"]),
+        "content": task_info,
+        "due": {"string": "today"}
+    }
+    task.update({field: item_command["args"][field] for field in TODOIST_TASK_FIELDS if field in item_command["args"]})
+    logger.info(f"Task created successfully with ID: {task['id']}")
+    
+    if len(commands) > 1:
+        note_command = commands[1]
+        status = result["sync_status"].get(note_command["uuid"])
+        if status == "ok":
+            logger.info("File attached to task successfully")
+            task["file_attachment"] = dict(note_command["args"], item_id=task["id"],
+                                           id=result["temp_id_mapping"].get(note_command["temp_id"]))
+        else:
+            logger.error(f"Error attaching file to task: {status}")
+    return task
+
+def create_todoist_task_with_sync(task_info, image_data, mime_type, upload_future, task_fields=None):
+    """
+    Create the task and its attachment comment with one coalesced Sync API request
+    Raises TodoistSyncError if Todoist rejected the batch, so the caller can use the REST API instead
+    """
+    filename = attachment_filename()
+    mime_type = mime_type or "image/jpeg"
+    
+    # The file itself still has to be uploaded on its own
+    upload_data = None
+    if image_data:
+        if upload_future is not None:
+            upload_data = upload_future.result()
+            if not upload_data:
+                logger.warning("Parallel upload failed, uploading the file again")
+                ATTACHMENT_FALLBACKS.labels(reason="parallel_upload_failed").inc()
+        if not upload_data:
+            upload_data = upload_file_to_todoist(image_data, filename, mime_type)
+    
+    commands = build_task_commands(task_info, upload_data, filename, mime_type, task_fields)
+    with stage_timer("todoist_sync_batch"):
+        result = get_sync_batcher().submit(commands).result()
+    return apply_sync_result(task_info, commands, result)
 
-def create_todoist_task(task_info, image_data=None, mime_type=None):
+def create_todoist_task(task_info, image_data=None, mime_type=None, upload_future=None, task_fields=None):
     """
     Create a task in Todoist with the given information
+    task_fields are optional Todoist fields for the task, such as priority and labels
     If image_data is provided, attach it to the task
+    If upload_future is provided, it is an upload_file_to_todoist() call that was started
+    in parallel with the Claude analysis; its result is attached instead of uploading again
     """
+    # Coalesce the task and comment writes with those of concurrent requests
+    if TODOIST_SYNC_BATCHING:
+        try:
+            return create_todoist_task_with_sync(task_info, image_data, mime_type, upload_future, task_fields)
+        except TodoistSyncError as e:
+            logger.warning(f"Sync API batch was rejected, creating the task with the REST API: {str(e)}")
+        except UpstreamBusyError:
+            raise
+        except Exception as e:
+            logger.error(f"Error creating Todoist task: {str(e)}", exc_info=True)
+            raise Exception(f"Failed to create Todoist task: {str(e)}")
+    
     try:
-        # Todoist API endpoint for tasks
-        task_url = "https://api.todoist.com/rest/v2/tasks"
-        
-        # Headers with authentication
-        headers = {
-            "Authorization": f"Bearer {TODOIST_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        # Task data
-        task_data = {
-            "content": task_info,
-            "due_string": "today"  # Default due date is today
-        }
+        # Shared client with pooled keep-alive connections and retries
+        todoist = get_todoist_client()
         
         # Make the request to create the task
-        task_response = requests.post(task_url, headers=headers, json=task_data)
+        with stage_timer("todoist_task_create"):
+            task_response = todoist.post("/rest/v2/tasks", json=build_task_data(task_info, task_fields),
+                                         request_id=todoist_request_id("task"))
         
         # Check if the request was successful
+        if task_response.status_code == 429:
+            raise UpstreamBusyError.from_response("todoist", task_response)
         if task_response.status_code != 200:
             error_msg = f"Todoist API error: {task_response.status_code} - {task_response.text}"
             logger.error(error_msg)
@@ -411,13 +3599,31 @@ def create_todoist_task(task_info, image_data=None, mime_type=None):
         task = task_response.json()
         logger.info(f"Task created successfully with ID: {task['id']}")
         
+        # Set a default filename and mime type if not provided
+        filename = attachment_filename()
+        if not mime_type:
+            mime_type = "image/jpeg"
+        
+        # Use the upload that ran in parallel with the Claude call, if there is one
+        if image_data and upload_future is not None:
+            upload_data = upload_future.result()
+            if upload_data:
+                logger.info("Attaching file uploaded in parallel with the Claude call")
+                try:
+                    return attach_uploaded_file(task, upload_data, filename, mime_type)
+                except Exception as e:
+                    logger.error(f"Error attaching file to task: {str(e)}", exc_info=True)
+                    return task
+            logger.warning("Parallel upload failed, uploading the file again")
+            ATTACHMENT_FALLBACKS.labels(reason="parallel_upload_failed").inc()
+        
         # If image data is provided, upload it and attach to the task
         if image_data:
             logger.info(f"Attempting to upload image to Todoist (data length: {len(image_data)} bytes)")
             
             # Convert image_data to the correct format for upload
-            # If it's already bytes, use it directly
-            if isinstance(image_data, bytes):
+            # If it's already bytes (or a memory-mapped upload), use it directly
+            if isinstance(image_data, (bytes, bytearray, memoryview, mmap.mmap)):
                 logger.debug("Image data is already in bytes format")
                 binary_data = image_data
             # If it's base64 string, decode it
@@ -430,134 +3636,143 @@ def create_todoist_task(task_info, image_data=None, mime_type=None):
                 logger.error(f"Image data is not in a recognized format: {type(image_data)}")
                 return task
             
-            logger.debug(f"Binary data prepared, length: {len(binary_data)} bytes, first 50 bytes: {binary_data[:50]}")
-            
-            # Try using the REST API first (v2)
-            try:
-                # REST API for file uploads
-                upload_url = "https://api.todoist.com/rest/v2/attachments"
-                upload_headers = {
-                    "Authorization": f"Bearer {TODOIST_API_KEY}"
-                }
-                
-                # Set a default filename and mime type if not provided
-                filename = f"screenshot_{int(time.time())}.jpg"
-                if not mime_type:
-                    mime_type = "image/jpeg"
-                
-                logger.debug(f"Uploading with filename: {filename}, mime_type: {mime_type}")
-                logger.debug(f"API Key validity check: {'VALID' if TODOIST_API_KEY and len(TODOIST_API_KEY) > 20 else 'INVALID'}")
-                
-                # Create a file-like object from the image data
-                file_obj = io.BytesIO(binary_data)
-                
-                # Create the multipart/form-data payload
-                files = {
-                    'file': (filename, file_obj, mime_type)
-                }
-                
-                # Upload the file to Todoist REST API
-                logger.debug(f"Making REST API request to {upload_url} with task_id: {task['id']}")
-                upload_response = requests.post(
-                    upload_url, 
-                    headers=upload_headers, 
-                    files=files,
-                    params={"task_id": task["id"]}
-                )
-                
-                logger.debug(f"Upload response status: {upload_response.status_code}")
-                logger.debug(f"Upload response body: {upload_response.text}")
-                
-                if upload_response.status_code in (200, 201):
-                    logger.info("File uploaded successfully via REST API")
-                    attachment_data = upload_response.json()
-                    task["file_attachment"] = attachment_data
-                    return task
-                else:
-                    logger.warning(f"REST API upload failed with status {upload_response.status_code}: {upload_response.text}")
-                    logger.warning(f"Trying Sync API...")
-            except Exception as e:
-                logger.error(f"Error with REST API upload: {str(e)}", exc_info=True)
-                logger.warning("Falling back to Sync API...")
+            logger.debug(f"Binary data prepared, length: {len(binary_data)} bytes")
             
-            # If REST API failed, try the Sync API (v8)
-            try:
-                # Sync API for file uploads
-                upload_url = "https://api.todoist.com/sync/v9/uploads/add"
-                upload_headers = {
-                    "Authorization": f"Bearer {TODOIST_API_KEY}"
-                }
-                
-                # Create a file-like object from the image data
-                file_obj = io.BytesIO(binary_data)
-                
-                # Create the multipart/form-data payload
-                files = {
-                    'file': (filename, file_obj, mime_type)
-                }
-                
-                # Upload the file to Todoist Sync API
-                logger.debug(f"Making Sync API request to {upload_url}")
-                upload_response = requests.post(upload_url, headers=upload_headers, files=files)
-                
-                logger.debug(f"Sync API upload response status: {upload_response.status_code}")
-                logger.debug(f"Sync API upload response body: {upload_response.text}")
-                
-                if upload_response.status_code != 200:
-                    logger.error(f"Error uploading file with Sync API: {upload_response.status_code} - {upload_response.text}")
-                    return task
-                
-                # Get the upload details
-                upload_data = upload_response.json()
-                file_url = upload_data.get("file_url")
-                
-                if file_url:
-                    logger.info(f"File uploaded successfully via Sync API, URL: {file_url}")
+            # Try using the REST API first (v2), unless it has been rejecting attachments
+            if attachment_breaker.allow_rest(len(binary_data), count_skip=not rest_skip_counted(upload_future)):
+                try:
+                    # REST API for file uploads
+                    upload_url = "/rest/v2/attachments"
                     
-                    # Add a comment with the file attachment to the task
-                    comment_url = "https://api.todoist.com/rest/v2/comments"
+                    logger.debug(f"Uploading with filename: {filename}, mime_type: {mime_type}")
+                    logger.debug(f"API Key validity check: {'VALID' if TODOIST_API_KEY and len(TODOIST_API_KEY) > 20 else 'INVALID'}")
                     
-                    # According to Todoist API, for file attachments, we need to follow their specific format
-                    comment_data = {
-                        "task_id": task["id"],
-                        "content": "Screenshot attachment",  # Adding a meaningful content message
-                        "attachment": {
-                            "resource_type": "image",  # Changed from "file" to "image"
-                            "file_url": file_url,
-                            "file_name": upload_data.get("file_name", filename),
-                            "file_type": upload_data.get("file_type", mime_type)
-                        }
-                    }
-                    
-                    logger.debug(f"Attaching file to task with comment data: {comment_data}")
+                    # Stream the multipart/form-data payload from the shared upload buffer
+                    body = MultipartBody('file', filename, binary_data, mime_type)
                     
-                    comment_response = requests.post(comment_url, headers=headers, json=comment_data)
+                    # Upload the file to Todoist REST API
+                    logger.debug(f"Making REST API request to {upload_url} with task_id: {task['id']}")
+                    with stage_timer("todoist_rest_attachment"):
+                        upload_response = todoist.post(
+                            upload_url, 
+                            data=body,
+                            headers={"Content-Type": body.content_type},
+                            params={"task_id": task["id"]}
+                        )
                     
-                    logger.debug(f"Comment response status: {comment_response.status_code}")
-                    logger.debug(f"Comment response body: {comment_response.text}")
+                    logger.debug(f"Upload response status: {upload_response.status_code}")
+                    logger.debug(f"Upload response body: {upload_response.text}")
                     
-                    if comment_response.status_code != 200:
-                        logger.error(f"Error attaching file to task: {comment_response.status_code} - {comment_response.text}")
+                    if attachment_breaker.record_response(upload_response.status_code):
+                        logger.info("File uploaded successfully via REST API")
+                        attachment_data = upload_response.json()
+                        task["file_attachment"] = attachment_data
+                        return task
                     else:
-                        logger.info("File attached to task successfully")
-                        # Add comment info to the task response
-                        task["file_attachment"] = comment_response.json()
-                else:
-                    logger.error(f"File upload succeeded but missing file_url. Response: {upload_data}")
-            except Exception as e:
-                logger.error(f"Error with Sync API upload: {str(e)}", exc_info=True)
+                        logger.warning(f"REST API upload failed with status {upload_response.status_code}: {upload_response.text}")
+                        logger.warning(f"Trying Sync API...")
+                except Exception as e:
+                    attachment_breaker.record_inconclusive()
+                    logger.error(f"Error with REST API upload: {str(e)}", exc_info=True)
+                    logger.warning("Falling back to Sync API...")
+                
+                ATTACHMENT_FALLBACKS.labels(reason="rest_attachment_failed").inc()
+            else:
+                logger.info("REST attachments have been failing, uploading with the Sync API directly")
+            
+            # If REST API failed or is skipped, try the Sync API and attach the upload with a comment
+            upload_data = upload_file_to_todoist(binary_data, filename, mime_type)
+            if upload_data:
+                try:
+                    attach_uploaded_file(task, upload_data, filename, mime_type)
+                except Exception as e:
+                    logger.error(f"Error attaching file to task: {str(e)}", exc_info=True)
         else:
             logger.warning("No image data provided, skipping file attachment")
         
         return task
             
+    except UpstreamBusyError:
+        raise
     except Exception as e:
         logger.error(f"Error creating Todoist task: {str(e)}", exc_info=True)
         raise Exception(f"Failed to create Todoist task: {str(e)}")
 
+# Startup timings of this process, reported in /stats
+startup_timings = {"import_seconds": None, "create_app_seconds": None, "first_request_seconds": None, "forked": False}
+startup_lock = threading.Lock()
+# When the first request arrived is measured from here; a forked worker starts counting at the fork
+process_started_at = IMPORT_STARTED_AT
+
+def reset_startup_timings():
+    global process_started_at
+    process_started_at = time.perf_counter()
+    startup_timings.update(first_request_seconds=None, forked=True)
+
+os.register_at_fork(after_in_child=reset_startup_timings)
+
+def create_app():
+    """
+    Create the Flask application
+    Logging is set up and the configuration checked once per process; the API clients, worker
+    threads and connection pools are only created on first use in each worker, so the app can be
+    created before Gunicorn forks its workers (preload_app)
+    Raises RuntimeError if an API key is missing
+    """
+    start_time = time.perf_counter()
+    configure_logging()
+    
+    # Log startup information
+    logger.info("Starting Screenshot to Todoist application")
+    logger.info(f"Python version: {sys.version}")
+    logger.info(f"Working directory: {os.getcwd()}")
+    logger.info(f"Anthropic SDK Version: {anthropic.__version__}")
+    
+    if not ANTHROPIC_API_KEY:
+        logger.error("ANTHROPIC_API_KEY is not set in environment variables")
+        raise RuntimeError("ANTHROPIC_API_KEY is not set in environment variables")
+    if not TODOIST_API_KEY:
+        logger.error("TODOIST_API_KEY is not set in environment variables")
+        raise RuntimeError("TODOIST_API_KEY is not set in environment variables")
+    
+    # Initialize Flask app
+    flask_app = Flask(__name__, static_folder='static')
+    flask_app.request_class = SpoolingRequest
+    flask_app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES
+    flask_app.register_blueprint(routes)
+    if STATIC_CACHE:
+        static_assets.preload(flask_app.static_folder, STATIC_PAGES)
+    
+    with startup_lock:
+        startup_timings["create_app_seconds"] = round(time.perf_counter() - start_time, 4)
+    logger.info(f"Application created in {startup_timings['create_app_seconds'] * 1000:.1f} ms "
+                f"(module import took {startup_timings['import_seconds'] * 1000:.1f} ms)")
+    return flask_app
+
+_app = None
+_app_lock = threading.Lock()
+
+def __getattr__(name):
+    # Create the module-level app on first access, so "screenshot_to_todoist:app" keeps working
+    global _app
+    if name == "app":
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+            return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+startup_timings["import_seconds"] = round(time.perf_counter() - IMPORT_STARTED_AT, 4)
+
 if __name__ == "__main__":
     # Create the static directory if it doesn't exist
     os.makedirs('static', exist_ok=True)
     
+    try:
+        app = create_app()
+    except Exception as e:
+        print(f"Error starting application: {e}", file=sys.stderr)
+        sys.exit(1)
+    
     # Run the Flask app (for development)
     app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
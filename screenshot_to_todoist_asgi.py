@@ -0,0 +1,623 @@
+"""
+ASGI entry point for Screenshot to Todoist
+
+/process-screenshot is served natively with AsyncAnthropic and a pooled async Todoist
+client, so one process can keep hundreds of screenshots waiting on Claude and Todoist
+without tying up a thread for each of them. All other routes are served by the Flask app.
+
+Usage:
+    SERVE_MODE=asgi gunicorn -c gunicorn.conf.py
+    uvicorn screenshot_to_todoist_asgi:create_app --factory --host 0.0.0.0 --port 5000
+"""
+import os
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from anthropic import AsyncAnthropic
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import screenshot_to_todoist as flask_app
+from screenshot_to_todoist import (
+    ANTHROPIC_API_KEY, ATTACHMENT_FALLBACKS, CLAUDE_STREAMING, IDEMPOTENCY_WAIT_TIMEOUT,
+    MAX_UPLOAD_BYTES, OUTBOX_MODE, RETRYABLE_STATUS_CODES, SCREENSHOT_REQUESTS, TODOIST_API_BASE,
+    TODOIST_API_KEY, TODOIST_CONNECT_TIMEOUT, TODOIST_MAX_RETRIES, TODOIST_READ_TIMEOUT,
+    TODOIST_RETRIES, TODOIST_RETRY_AFTER_MAX, TODOIST_RETRY_BUDGET, TODOIST_SYNC_BATCHING,
+    ClaudeAnalysis, MultipartBody, RequestTimings, TaskLineScanner, TodoistClient, TodoistSyncError,
+    UpstreamBusyError, apply_sync_result, attachment_breaker, attachment_filename,
+    build_screenshot_response, build_task_commands, build_task_data, claude_failure, clear_proxy_env,
+    current_idempotency_key, current_timings, finish_request_logging, get_outbox, get_sync_batcher,
+    idempotency_key_for, idempotency_store, logger, lookup_cached_analysis, outbound_limiters,
+    prepare_claude_image, queue_screenshot_job, queue_todoist_task, record_claude_stream,
+    record_client_upload, rest_skip_counted, stage_timer, start_request_logging, starts_parallel_upload,
+    store_analysis, todoist_request_id, todoist_task_fields
+)
+
+# Async client configuration; an idle keep-alive connection costs no thread here, so the
+# pools are sized for the number of screenshots in flight instead of a worker pool
+ASYNC_TODOIST_POOL_SIZE = int(os.getenv("ASYNC_TODOIST_POOL_SIZE", "100"))
+ASYNC_ANTHROPIC_POOL_SIZE = int(os.getenv("ASYNC_ANTHROPIC_POOL_SIZE", "500"))
+ANTHROPIC_TIMEOUT = float(os.getenv("ANTHROPIC_TIMEOUT", "600"))
+
+# Threads that serve the Flask routes mounted under the ASGI app
+ASGI_WSGI_WORKERS = int(os.getenv("ASGI_WSGI_WORKERS", "10"))
+
+class AsyncTodoistClient:
+    """
+    Async counterpart of TodoistClient
+    Shares one httpx connection pool between all requests on the event loop and retries
+    rate-limited and failed calls with the same jittered backoff, honouring Retry-After
+    """
+
+    def __init__(self, api_key, base_url=TODOIST_API_BASE, pool_size=ASYNC_TODOIST_POOL_SIZE,
+                 timeout=httpx.Timeout(TODOIST_READ_TIMEOUT, connect=TODOIST_CONNECT_TIMEOUT),
+                 max_retries=TODOIST_MAX_RETRIES):
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {api_key}"},
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=timeout
+        )
+        self.counters = {"requests": 0, "retries": 0, "errors": 0, "in_flight": 0}
+
+    async def request(self, method, path, request_id=None, max_retries=None, **kwargs):
+        """
+        Send a request to the Todoist API, retrying transient failures
+        request_id is sent as X-Request-Id so Todoist can deduplicate retried writes
+        A MultipartBody passed as data is streamed from the shared upload buffer
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        url = path if path.startswith("http") else f"{self.base_url}{path}"
+        headers = dict(kwargs.pop("headers", None) or {})
+        if request_id:
+            headers["X-Request-Id"] = request_id
+        body = kwargs.pop("data", None)
+        if isinstance(body, MultipartBody):
+            # Send a Content-Length so the body is not sent chunked
+            headers["Content-Length"] = str(len(body))
+
+        attempt = 0
+        deadline = time.monotonic() + TODOIST_RETRY_BUDGET
+        while True:
+            self.counters["requests"] += 1
+            if isinstance(body, MultipartBody):
+                # Streamed bodies have to be rewound before they can be sent again
+                body.seek(0)
+                kwargs["content"] = self._stream(body)
+            elif body is not None:
+                kwargs["data"] = body
+            self.counters["in_flight"] += 1
+            try:
+                async with outbound_limiters["todoist"].call_async() as outbound_call:
+                    response = await self.client.request(method, url, headers=headers, **kwargs)
+                    outbound_call.status_code = response.status_code
+            except httpx.TransportError as e:
+                self.counters["errors"] += 1
+                delay = TodoistClient._backoff(attempt)
+                if attempt >= max_retries or time.monotonic() + delay > deadline:
+                    raise
+                logger.warning(f"Todoist {method} {path} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES or attempt >= max_retries:
+                    return response
+                retry_after = TodoistClient._retry_after(response)
+                if retry_after is not None and retry_after > TODOIST_RETRY_AFTER_MAX:
+                    logger.warning(f"Todoist asked to retry {method} {path} after {retry_after}s, giving up")
+                    return response
+                delay = retry_after if retry_after is not None else TodoistClient._backoff(attempt)
+                if time.monotonic() + delay > deadline:
+                    # Hand the rate limit to the caller (503 or the outbox) before the proxy times out
+                    logger.warning(f"Todoist {method} {path} returned {response.status_code}, giving up as retrying in {delay:.2f}s exceeds the {TODOIST_RETRY_BUDGET}s retry budget")
+                    return response
+                logger.warning(f"Todoist {method} {path} returned {response.status_code}, retrying in {delay:.2f}s")
+            finally:
+                self.counters["in_flight"] -= 1
+
+            self.counters["retries"] += 1
+            TODOIST_RETRIES.inc()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    def stats(self):
+        """Report request counters and the size of the connection pool"""
+        return dict(self.counters, pool_maxsize=self.pool_size)
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    @staticmethod
+    async def _stream(body):
+        for chunk in body:
+            yield chunk
+
+# Clients are bound to the event loop, so they are created when the app starts serving
+_anthropic_client = None
+_todoist_client = None
+
+def get_async_anthropic_client():
+    """Return the shared AsyncAnthropic client, creating it on first use"""
+    global _anthropic_client
+    if _anthropic_client is None:
+        # httpx reads the proxy settings when the client is created
+        clear_proxy_env()
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ASYNC_ANTHROPIC_POOL_SIZE,
+                                max_keepalive_connections=ASYNC_ANTHROPIC_POOL_SIZE),
+            timeout=httpx.Timeout(ANTHROPIC_TIMEOUT, connect=5.0)
+        )
+        _anthropic_client = AsyncAnthropic(api_key=ANTHROPIC_API_KEY, http_client=http_client)
+    return _anthropic_client
+
+def get_async_todoist_client():
+    """Return the shared async Todoist client, creating it on first use"""
+    global _todoist_client
+    if _todoist_client is None:
+        _todoist_client = AsyncTodoistClient(TODOIST_API_KEY)
+    return _todoist_client
+
+@asynccontextmanager
+async def lifespan(app):
+    global _anthropic_client, _todoist_client
+    get_async_anthropic_client()
+    get_async_todoist_client()
+    if OUTBOX_MODE != "off":
+        get_outbox()
+    logger.info(f"ASGI app started (Todoist pool {ASYNC_TODOIST_POOL_SIZE}, Anthropic pool {ASYNC_ANTHROPIC_POOL_SIZE})")
+    try:
+        yield
+    finally:
+        await _todoist_client.aclose()
+        await _anthropic_client.close()
+        _anthropic_client = _todoist_client = None
+
+class UploadTooLargeError(Exception):
+    """The request body grew past MAX_UPLOAD_BYTES while it was being received"""
+
+def limit_upload_size(request):
+    """
+    Wrap a request so that reading its body raises UploadTooLargeError once more than
+    MAX_UPLOAD_BYTES have arrived; a chunked upload has no Content-Length to check up front
+    """
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > MAX_UPLOAD_BYTES:
+                raise UploadTooLargeError()
+        return message
+
+    return Request(request.scope, receive)
+
+def upload_too_large_response():
+    logger.warning(f"Rejected upload larger than {MAX_UPLOAD_BYTES} bytes")
+    return JSONResponse({"error": f"Upload exceeds the maximum size of {MAX_UPLOAD_BYTES} bytes"}, 413)
+
+async def process_screenshot(request):
+    """
+    Process a screenshot image without holding a thread while Claude and Todoist respond
+    Accepts the same form fields and query parameters as the Flask endpoint
+    """
+    timings = RequestTimings()
+    current_timings.set(timings)
+    log_buffer = start_request_logging()
+    response = await _process_screenshot(request)
+    response.headers["Server-Timing"] = timings.server_timing()
+    finish_request_logging(log_buffer, failed=response.status_code >= 400)
+    return response
+
+async def _process_screenshot(request):
+    try:
+        # Reject oversized uploads before reading the body, and stop reading one without a
+        # Content-Length (chunked) once it has grown past the limit
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+            return upload_too_large_response()
+        request = limit_upload_size(request)
+
+        # Time receiving the body and reading the image as one upload_read stage, like the WSGI route
+        with stage_timer("upload_read"):
+            form = await request.form()
+            image_file = form.get('image')
+            if isinstance(image_file, UploadFile):
+                image_data = await image_file.read()
+
+        def param(name, default=''):
+            value = request.query_params.get(name) or form.get(name)
+            return value if isinstance(value, str) else default
+
+        debug_mode = param('debug', 'false').lower() == 'true'
+        async_mode = param('async', 'false').lower() == 'true'
+
+        # Get additional instructions if provided
+        additional_instructions = param('additional_instructions').strip()
+        if additional_instructions:
+            logger.info(f"Additional instructions received: {additional_instructions}")
+        else:
+            logger.info("No additional instructions provided, using default")
+            additional_instructions = "no additional instructions"
+
+        # Check if the request contains an image
+        if not isinstance(image_file, UploadFile):
+            logger.error("No image file in request")
+            return JSONResponse({"error": "No image file provided"}, 400)
+
+        file_name = param('file_name', image_file.filename) or image_file.filename
+        mime_type = image_file.content_type or "image/jpeg"  # Default to JPEG if not specified
+        await form.close()
+        logger.info(f"Received image: {file_name}, type: {mime_type}, size: {len(image_data)} bytes")
+        record_client_upload(param('original_size'), len(image_data), param('original_dimensions'))
+
+        # A retry of a request that is running or finished gets that request's response
+        idempotency_key = await asyncio.to_thread(idempotency_key_for, request.headers, image_data,
+                                                  additional_instructions, debug_mode, async_mode)
+        if idempotency_key:
+            stored = await claim_idempotency_key(idempotency_key)
+            if stored is not None:
+                data, status, headers = stored
+                return JSONResponse(data, status, headers=dict(headers, **{"Idempotent-Replayed": "true"}))
+            current_idempotency_key.set(idempotency_key)
+
+        # Async mode still goes through the job pool so /jobs/<id> works the same way
+        if async_mode:
+            job_id = queue_screenshot_job(image_data, mime_type, file_name, additional_instructions, debug_mode)
+            if job_id is None:
+                if idempotency_key:
+                    idempotency_store.fail(idempotency_key)
+                return JSONResponse({"error": "Too many screenshots are being processed, please retry later"},
+                                    503, headers={"Retry-After": "5"})
+            data, headers = {"status": "queued", "job_id": job_id, "status_url": f"jobs/{job_id}"}, {"Location": f"jobs/{job_id}"}
+            if idempotency_key:
+                idempotency_store.complete(idempotency_key, data, 202, headers)
+            return JSONResponse(data, 202, headers=headers)
+
+        response_data = await run_screenshot_pipeline(image_data, mime_type, file_name, additional_instructions, debug_mode)
+        if idempotency_key:
+            idempotency_store.complete(idempotency_key, response_data, 200)
+        return JSONResponse(response_data, 200)
+
+    except UploadTooLargeError:
+        return upload_too_large_response()
+    except UpstreamBusyError as e:
+        # Tell the client when to retry instead of failing with a 500
+        logger.warning(f"Rejecting screenshot, {e.upstream} is busy: {str(e)}")
+        if current_idempotency_key.get():
+            idempotency_store.fail(current_idempotency_key.get())
+        return JSONResponse({"error": str(e), "upstream": e.upstream}, 503,
+                            headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        logger.error(f"Error processing screenshot: {str(e)}", exc_info=True)
+        if current_idempotency_key.get():
+            idempotency_store.fail(current_idempotency_key.get())
+        return JSONResponse({"error": str(e)}, 500)
+
+async def claim_idempotency_key(key):
+    """
+    Claim an idempotency key for the current request, waiting while a request with the same key runs
+    Returns the response to replay as (data, status, headers), or None once the key is claimed
+    """
+    while True:
+        stored, running = idempotency_store.begin(key)
+        if running is None:
+            if stored is not None:
+                logger.info(f"Replaying stored response for idempotency key {key[:60]}")
+            return stored
+        logger.info(f"Waiting for the running request with idempotency key {key[:60]}")
+        # Poll instead of blocking a thread per waiting retry
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+        while not running["event"].is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if not running["event"].is_set():
+            return ({"error": "A request with this idempotency key is still being processed"}, 409,
+                    {"Retry-After": "5"})
+
+async def run_screenshot_pipeline(image_data, mime_type, file_name, additional_instructions, debug_mode=False):
+    """
+    Run the Claude and Todoist stages for an uploaded screenshot on the event loop
+    Returns the response data that is sent back to the client
+    """
+    try:
+        with stage_timer("total"):
+            response_data = await _run_screenshot_pipeline(image_data, mime_type, file_name,
+                                                           additional_instructions, debug_mode)
+    except Exception:
+        SCREENSHOT_REQUESTS.labels(outcome="error").inc()
+        raise
+    SCREENSHOT_REQUESTS.labels(outcome="success").inc()
+    return response_data
+
+async def _run_screenshot_pipeline(image_data, mime_type, file_name, additional_instructions, debug_mode):
+    # The Sync API upload does not depend on Claude's output, so start it right away
+    # While REST attachments are failing the Sync API upload is needed anyway
+    upload_task = None
+    if starts_parallel_upload(image_data):
+        upload_task = asyncio.create_task(
+            upload_file_to_todoist(image_data, attachment_filename(), mime_type or "image/jpeg"))
+
+    try:
+        task_info, anthropic_response, analysis_info = await analyze_screenshot(image_data, mime_type,
+                                                                                additional_instructions)
+    except Exception:
+        if upload_task is not None:
+            upload_task.cancel()
+        raise
+
+    logger.info(f"Creating Todoist task: {task_info}")
+    task_fields = todoist_task_fields(anthropic_response)
+    if OUTBOX_MODE == "always":
+        todoist_response = await asyncio.to_thread(queue_todoist_task, task_info, image_data, mime_type,
+                                                   task_fields=task_fields)
+    else:
+        try:
+            todoist_response = await create_todoist_task(task_info, image_data, mime_type, upload_task=upload_task,
+                                                         task_fields=task_fields)
+        except Exception as e:
+            if OUTBOX_MODE != "fallback":
+                raise
+            # Keep the analysis and let the outbox create the task once Todoist recovers
+            logger.warning(f"Todoist task creation failed, queueing the task in the outbox: {str(e)}")
+            todoist_response = await asyncio.to_thread(queue_todoist_task, task_info, image_data, mime_type, e,
+                                                       task_fields)
+
+    return build_screenshot_response(task_info, anthropic_response, analysis_info, todoist_response,
+                                     image_data, mime_type, file_name, debug_mode)
+
+async def analyze_screenshot(image_data, mime_type, additional_instructions):
+    """
+    Analyze a screenshot, serving repeated or near-identical screenshots from the result cache
+    Hashing and image preprocessing run in a thread so they do not block the event loop
+    """
+    fingerprint, cached, analysis_info = await asyncio.to_thread(lookup_cached_analysis, image_data,
+                                                                 additional_instructions)
+    if cached:
+        return cached[0], cached[1], analysis_info
+
+    base64_image, mime_type = await asyncio.to_thread(prepare_claude_image, image_data, mime_type, analysis_info)
+
+    logger.info("Calling Claude Vision API")
+    task_info, anthropic_response = await analyze_image_with_claude(base64_image, mime_type, additional_instructions)
+
+    await asyncio.to_thread(store_analysis, fingerprint, task_info, anthropic_response)
+    return task_info, anthropic_response, analysis_info
+
+async def call_claude(model, claude_request, stream_reply=CLAUDE_STREAMING):
+    """
+    Run one Claude analysis call, streaming the reply if stream_reply is set
+    Returns the (possibly partial) message and the streaming details, or None when not streamed
+    """
+    anthropic_client = get_async_anthropic_client()
+    if not stream_reply:
+        response = await anthropic_client.messages.create(model=model, **claude_request)
+        return response, None
+
+    start_time = time.perf_counter()
+    first_token_time = task_time = None
+    stopped_early = False
+    scanner = TaskLineScanner()
+    async with anthropic_client.messages.stream(model=model, **claude_request) as stream:
+        async for text in stream.text_stream:
+            first_token_time = first_token_time or time.perf_counter()
+            if scanner.feed(text):
+                # Everything after the task line is discarded anyway, so close the stream
+                task_time = time.perf_counter()
+                stopped_early = True
+                break
+        else:
+            if scanner.finish():
+                task_time = time.perf_counter()
+        response = stream.current_message_snapshot if stopped_early else await stream.get_final_message()
+    return response, record_claude_stream(model, start_time, first_token_time, task_time, stopped_early)
+
+async def analyze_image_with_claude(base64_image, mime_type, additional_instructions=''):
+    """
+    Send the image to Claude Vision API with AsyncAnthropic
+    ClaudeAnalysis decides which models are called and which reply is used
+    Returns the task information and the full response from Claude
+    """
+    try:
+        analysis = ClaudeAnalysis(base64_image, mime_type, additional_instructions)
+        call = analysis.next_call()
+        while call is not None:
+            model, claude_request, stream_reply = call
+            logger.debug(f"Sending request to Claude API ({model})")
+            async with outbound_limiters["anthropic"].call_async():
+                with stage_timer("claude_call"):
+                    response, streaming = await call_claude(model, claude_request, stream_reply=stream_reply)
+            analysis.handle_reply(response, streaming)
+            call = analysis.next_call()
+        return analysis.result
+    except Exception as e:
+        raise claude_failure(e)
+
+async def upload_file_to_todoist(binary_data, filename, mime_type):
+    """
+    Upload a file with the Todoist Sync API
+    Returns the upload details, or None if the upload failed
+    """
+    try:
+        body = MultipartBody('file', filename, binary_data, mime_type)
+        with stage_timer("todoist_sync_upload"):
+            upload_response = await get_async_todoist_client().post(
+                "/sync/v9/uploads/add", data=body, headers={"Content-Type": body.content_type})
+
+        if upload_response.status_code != 200:
+            logger.error(f"Error uploading file with Sync API: {upload_response.status_code} - {upload_response.text}")
+            return None
+
+        upload_data = upload_response.json()
+        if not upload_data.get("file_url"):
+            logger.error(f"File upload succeeded but missing file_url. Response: {upload_data}")
+            return None
+
+        logger.info(f"File uploaded successfully via Sync API, URL: {upload_data['file_url']}")
+        return upload_data
+    except Exception as e:
+        logger.error(f"Error with Sync API upload: {str(e)}", exc_info=True)
+        return None
+
+async def attach_uploaded_file(task, upload_data, filename, mime_type):
+    """
+    Attach a file uploaded with the Sync API to the task as a comment
+    Adds the comment to the task as "file_attachment" on success
+    """
+    comment_data = {
+        "task_id": task["id"],
+        "content": "Screenshot attachment",
+        "attachment": {
+            "resource_type": "image",
+            "file_url": upload_data["file_url"],
+            "file_name": upload_data.get("file_name", filename),
+            "file_type": upload_data.get("file_type", mime_type)
+        }
+    }
+
+    with stage_timer("todoist_comment"):
+        comment_response = await get_async_todoist_client().post(
+            "/rest/v2/comments", json=comment_data, request_id=todoist_request_id("comment"))
+
+    if comment_response.status_code != 200:
+        logger.error(f"Error attaching file to task: {comment_response.status_code} - {comment_response.text}")
+    else:
+        logger.info("File attached to task successfully")
+        task["file_attachment"] = comment_response.json()
+    return task
+
+async def create_todoist_task_with_sync(task_info, image_data, mime_type, upload_task, task_fields=None):
+    """
+    Create the task and its attachment comment with one coalesced Sync API request
+    Raises TodoistSyncError if Todoist rejected the batch, so the caller can use the REST API instead
+    """
+    filename = attachment_filename()
+    mime_type = mime_type or "image/jpeg"
+
+    upload_data = None
+    if image_data:
+        if upload_task is not None:
+            upload_data = await upload_task
+            if not upload_data:
+                logger.warning("Parallel upload failed, uploading the file again")
+                ATTACHMENT_FALLBACKS.labels(reason="parallel_upload_failed").inc()
+        if not upload_data:
+            upload_data = await upload_file_to_todoist(image_data, filename, mime_type)
+
+    # The batcher sends the batch from its own thread, so waiting on it does not block the event loop
+    commands = build_task_commands(task_info, upload_data, filename, mime_type, task_fields)
+    with stage_timer("todoist_sync_batch"):
+        result = await asyncio.wrap_future(get_sync_batcher().submit(commands))
+    return apply_sync_result(task_info, commands, result)
+
+async def create_todoist_task(task_info, image_data=None, mime_type=None, upload_task=None, task_fields=None):
+    """
+    Create a task in Todoist and attach the screenshot
+    task_fields are optional Todoist fields for the task, such as priority and labels
+    If upload_task is provided, it is an upload_file_to_todoist() call that was started
+    in parallel with the Claude analysis; its result is attached instead of uploading again
+    """
+    # Coalesce the task and comment writes with those of concurrent requests
+    if TODOIST_SYNC_BATCHING:
+        try:
+            return await create_todoist_task_with_sync(task_info, image_data, mime_type, upload_task, task_fields)
+        except TodoistSyncError as e:
+            logger.warning(f"Sync API batch was rejected, creating the task with the REST API: {str(e)}")
+
+    todoist = get_async_todoist_client()
+
+    with stage_timer("todoist_task_create"):
+        task_response = await todoist.post("/rest/v2/tasks", json=build_task_data(task_info, task_fields),
+                                           request_id=todoist_request_id("task"))
+
+    if task_response.status_code == 429:
+        raise UpstreamBusyError.from_response("todoist", task_response)
+    if task_response.status_code != 200:
+        error_msg = f"Todoist API error: {task_response.status_code} - {task_response.text}"
+        logger.error(error_msg)
+        raise Exception(error_msg)
+
+    task = task_response.json()
+    logger.info(f"Task created successfully with ID: {task['id']}")
+    if not image_data:
+        return task
+
+    filename = attachment_filename()
+    mime_type = mime_type or "image/jpeg"
+
+    # Use the upload that ran in parallel with the Claude call, if there is one
+    if upload_task is not None:
+        upload_data = await upload_task
+        if upload_data:
+            logger.info("Attaching file uploaded in parallel with the Claude call")
+            try:
+                return await attach_uploaded_file(task, upload_data, filename, mime_type)
+            except Exception as e:
+                logger.error(f"Error attaching file to task: {str(e)}", exc_info=True)
+                return task
+        logger.warning("Parallel upload failed, uploading the file again")
+        ATTACHMENT_FALLBACKS.labels(reason="parallel_upload_failed").inc()
+
+    # Try the REST API first, unless it has been rejecting attachments
+    if attachment_breaker.allow_rest(len(image_data), count_skip=not rest_skip_counted(upload_task)):
+        try:
+            body = MultipartBody('file', filename, image_data, mime_type)
+            with stage_timer("todoist_rest_attachment"):
+                upload_response = await todoist.post("/rest/v2/attachments", data=body,
+                                                     headers={"Content-Type": body.content_type},
+                                                     params={"task_id": task["id"]})
+            if attachment_breaker.record_response(upload_response.status_code):
+                logger.info("File uploaded successfully via REST API")
+                task["file_attachment"] = upload_response.json()
+                return task
+            logger.warning(f"REST API upload failed with status {upload_response.status_code}: {upload_response.text}")
+        except Exception as e:
+            attachment_breaker.record_inconclusive()
+            logger.error(f"Error with REST API upload: {str(e)}", exc_info=True)
+        logger.warning("Falling back to Sync API...")
+        ATTACHMENT_FALLBACKS.labels(reason="rest_attachment_failed").inc()
+    else:
+        logger.info("REST attachments have been failing, uploading with the Sync API directly")
+
+    # If REST API failed or is skipped, try the Sync API and attach the upload with a comment
+    upload_data = await upload_file_to_todoist(image_data, filename, mime_type)
+    if upload_data:
+        try:
+            await attach_uploaded_file(task, upload_data, filename, mime_type)
+        except Exception as e:
+            logger.error(f"Error attaching file to task: {str(e)}", exc_info=True)
+    return task
+
+def create_app():
+    """Create the ASGI application, wrapping a new Flask app for every route but /process-screenshot"""
+    return Starlette(
+        routes=[
+            Route('/process-screenshot', process_screenshot, methods=['POST']),
+            Mount('/', app=WSGIMiddleware(flask_app.create_app(), workers=ASGI_WSGI_WORKERS))
+        ],
+        lifespan=lifespan
+    )
+
+_app = None
+
+def __getattr__(name):
+    # Create the module-level app on first access, so "screenshot_to_todoist_asgi:app" keeps working
+    global _app
+    if name == "app":
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
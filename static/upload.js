@@ -0,0 +1,52 @@
+// Browser-side resizing of screenshots, included by the upload page and the tester
+
+// The size, format and quality the server needs, so large screenshots are resized before the upload
+let uploadProfile = Promise.resolve(null);
+
+// Fetch the upload profile from the URL the page builds, so this works behind a path prefix as well
+function loadUploadProfile(url) {
+    uploadProfile = fetch(url)
+        .then(response => response.ok ? response.json() : null)
+        .catch(() => null);
+}
+
+// Resize and re-encode the image in the browser to match the upload profile
+// Falls back to the original file if resizing is not needed, not supported or does not make it smaller
+async function prepareUpload(file, onWarning = message => console.warn(message)) {
+    const upload = { blob: file, name: file.name, originalSize: file.size, originalDimensions: '' };
+    const profile = await uploadProfile;
+    if (!profile || !profile.resize || !window.createImageBitmap) {
+        return upload;
+    }
+
+    try {
+        const bitmap = await createImageBitmap(file, { imageOrientation: 'from-image' });
+        const width = bitmap.width;
+        const height = bitmap.height;
+        upload.originalDimensions = `${width}x${height}`;
+
+        const scale = Math.min(1, profile.max_edge / Math.max(width, height), Math.sqrt(profile.max_pixels / (width * height)));
+        const canvas = document.createElement('canvas');
+        canvas.width = Math.max(1, Math.floor(width * scale));
+        canvas.height = Math.max(1, Math.floor(height * scale));
+        const context = canvas.getContext('2d');
+        // Flatten transparency onto white, as the server does
+        context.fillStyle = '#ffffff';
+        context.fillRect(0, 0, canvas.width, canvas.height);
+        context.imageSmoothingQuality = 'high';
+        context.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+        bitmap.close();
+
+        const blob = await new Promise(resolve => canvas.toBlob(resolve, profile.format, profile.quality));
+        if (!blob || blob.size >= file.size) {
+            return upload;
+        }
+        const extension = blob.type.split('/')[1].replace('jpeg', 'jpg');
+        upload.blob = blob;
+        upload.name = file.name.replace(/\.[^.]*$/, '') + '.' + extension;
+        upload.dimensions = `${canvas.width}x${canvas.height}`;
+    } catch (error) {
+        onWarning(`Could not resize the image, uploading the original: ${error.message}`);
+    }
+    return upload;
+}